@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from datetime import date, timedelta
+
+import fsspec
+import humanize
+
+from helper_functions.helpers import server_app_folder_content_check
+from helper_functions.instrumentation import InstrumentedFileSystem, enable_profiling
+from helper_functions.expectation_tree import load_expectation_tree
+from helper_functions.listing_cache import ListingCache
+from scripts.backups import backup_check
+
+# Host name the synthetic backup server is recorded under by the profiler.
+SYNTHETIC_HOST = "synthetic"
+
+
+class LatencyFileSystem:
+    """
+    Wrapper around a local filesystem that sleeps `latency` seconds before every call
+    that would be a round trip to a remote server, to stand in for an SFTP server.
+    Every other attribute is delegated to the wrapped filesystem.
+    """
+
+    def __init__(self, fs, latency):
+        self.fs = fs
+        self.latency = latency
+
+    def ls(self, path, *args, **kwargs):
+        time.sleep(self.latency)
+        return self.fs.ls(path, *args, **kwargs)
+
+    def info(self, path, **kwargs):
+        time.sleep(self.latency)
+        return self.fs.info(path, **kwargs)
+
+    def open(self, path, *args, **kwargs):
+        time.sleep(self.latency)
+        return self.fs.open(path, *args, **kwargs)
+
+    def cat_file(self, path, *args, **kwargs):
+        time.sleep(self.latency)
+        return self.fs.cat_file(path, *args, **kwargs)
+
+    def get(self, rpath, lpath, *args, **kwargs):
+        time.sleep(self.latency)
+        return self.fs.get(rpath, lpath, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
+
+
+def build_folder(fs, snapshot_folder, folder_path, depth, shape, snapshot_index):
+    """
+    Writes a synthetic app folder (and its sub-folders, down to `shape.depth`) to the
+    filesystem and returns its config entry. Inner folders hold `shape.files` files
+    listed by name; the deepest folders are only checked for their extension.
+    """
+    node = {"path": folder_path}
+    is_leaf = depth == shape.depth
+
+    if is_leaf:
+        node["expected-file-extensions"] = [".sql.gz"]
+        file_names = [f"dump-{i}.sql.gz" for i in range(shape.files)]
+    else:
+        file_names = [f"file-{i}.txt" for i in range(shape.files)]
+        node["expected-files"] = file_names
+
+    for file_name in file_names:
+        # Sizes vary between snapshots, so the size checks have something to compare
+        fs.pipe(
+            f"{snapshot_folder}/{folder_path}/{file_name}",
+            b"x" * (64 + snapshot_index),
+        )
+
+    if not is_leaf:
+        for i in range(shape.fan_out):
+            node[f"folder-{i}"] = build_folder(
+                fs,
+                snapshot_folder,
+                f"{folder_path}/folder-{i}",
+                depth + 1,
+                shape,
+                snapshot_index,
+            )
+
+    return node
+
+
+def build_synthetic_backup_server(shape):
+    """
+    Builds a synthetic backup server in an in-memory filesystem and writes the
+    matching `file_structure/` configs to the current directory. Every server gets
+    `shape.snapshots` daily snapshot folders (the latest one from today) holding
+    `shape.apps` apps.
+    """
+    fs = fsspec.filesystem("memory")
+
+    # The memory filesystem is process-wide; start from an empty one
+    fs.store.clear()
+    fs.pseudo_dirs[:] = [""]
+
+    server_apps = {}
+    full_backup_locations = {}
+
+    for server_index in range(shape.servers):
+        server = f"server-{server_index}"
+        apps = {}
+
+        for snapshot_index in range(shape.snapshots):
+            snapshot_date = date.today() - timedelta(days=snapshot_index)
+            snapshot_folder = f"/{server}/data_backup_{snapshot_date:%Y%m%d}T054501"
+
+            for app_index in range(shape.apps):
+                app = f"app-{app_index}"
+                apps[app] = build_folder(
+                    fs, snapshot_folder, f"data/{app}", 0, shape, snapshot_index
+                )
+
+        server_apps[server] = {"applications": apps}
+        full_backup_locations[server] = {
+            app: {"backup-folders": [f"folder-{i}" for i in range(shape.fan_out)]}
+            for app in apps
+        }
+
+    os.makedirs("file_structure", exist_ok=True)
+
+    with open("file_structure/app_backup_server_content.json", "w") as file:
+        json.dump(server_apps, file, indent=2)
+
+    with open("file_structure/app_backups.json", "w") as file:
+        json.dump(full_backup_locations, file, indent=2)
+
+    return fs, server_apps, full_backup_locations
+
+
+def measure(func, runs):
+    """
+    Runs `func` `runs` times (with its output discarded) and once more under
+    `tracemalloc`. Returns the wall time of every run, the remote calls of the last
+    run per operation, and the peak memory allocated by a run.
+    """
+    durations = []
+    calls = {}
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(runs):
+            profiler = enable_profiling()
+
+            started_at = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - started_at)
+
+            calls = {
+                operation: stats.calls
+                for (host, operation), stats in profiler.stats.items()
+                if host == SYNTHETIC_HOST
+            }
+
+        tracemalloc.start()
+        try:
+            func()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return durations, calls, peak_memory
+
+
+def run_benchmarks(shape, options):
+    """
+    Benchmarks the backup checks against a synthetic backup server and returns one
+    result per benchmarked check.
+    """
+    memory_fs, server_apps, full_backup_locations = build_synthetic_backup_server(
+        shape
+    )
+    fs = InstrumentedFileSystem(
+        LatencyFileSystem(memory_fs, shape.latency_ms / 1000), SYNTHETIC_HOST
+    )
+
+    expectation_tree = load_expectation_tree(
+        "file_structure/app_backup_server_content.json"
+    )
+
+    # The single app checks run against the first app of the first server
+    server = next(iter(server_apps))
+    app = next(iter(server_apps[server]["applications"]))
+    server_backup_folders = backup_check.get_server_backup_folders(memory_fs, server)
+
+    def all_checks():
+        # Fresh listing cache per run, like `backup_server_checks`
+        cached_fs = ListingCache().wrap(fs, SYNTHETIC_HOST)
+
+        if options.use_async:
+            asyncio.run(backup_check.server_backup_checks_async(cached_fs, options))
+        else:
+            backup_check.server_backup_checks(cached_fs, options)
+
+    def app_folder_content_check():
+        server_app_folder_content_check(
+            fs,
+            expectation_tree,
+            server,
+            app,
+            server_backup_folders[0][0],
+            options.max_in_flight,
+            stream_extensions=options.stream_extensions,
+        )
+
+    def backup_size_check():
+        backup_check.check_backup_size(
+            fs,
+            server_backup_folders[0],
+            server_backup_folders[1],
+            full_backup_locations,
+            server,
+            app,
+        )
+
+    benchmarks = {
+        "server_backup_checks": all_checks,
+        "server_app_folder_content_check": app_folder_content_check,
+        "check_backup_size": backup_size_check,
+    }
+
+    results = []
+    for name, func in benchmarks.items():
+        durations, calls, peak_memory = measure(func, shape.runs)
+        mean_duration = sum(durations) / len(durations)
+
+        results.append(
+            {
+                "check": name,
+                "runs": len(durations),
+                "runs_per_second": 1 / mean_duration,
+                "mean_ms": mean_duration * 1000,
+                "min_ms": min(durations) * 1000,
+                "remote_calls": sum(calls.values()),
+                "remote_calls_per_operation": calls,
+                "peak_memory_bytes": peak_memory,
+            }
+        )
+
+    return results
+
+
+def print_results(shape, results):
+    folders_per_app = sum(shape.fan_out**depth for depth in range(shape.depth + 1))
+
+    print("\n#")
+    print("# Backup check benchmarks")
+    print("#\n")
+    print(
+        f"* {shape.servers} server(s) x {shape.apps} app(s) x {shape.snapshots} snapshot(s), {folders_per_app} folder(s) of {shape.files} file(s) per app, {shape.latency_ms}ms per remote call\n"
+    )
+    print(
+        f"{"check":<34} {"runs/s":>9} {"mean ms":>10} {"min ms":>10} {"calls/run":>10} {"peak memory":>12}"
+    )
+
+    for result in results:
+        print(
+            f"{result["check"]:<34} {result["runs_per_second"]:>9.2f} {result["mean_ms"]:>10.1f} {result["min_ms"]:>10.1f} {result["remote_calls"]:>10} {humanize.naturalsize(result["peak_memory_bytes"], gnu=True):>12}"
+        )
+        print(
+            f"{"":<34} {", ".join(f"{operation}: {count}" for operation, count in sorted(result["remote_calls_per_operation"].items()))}"
+        )
+
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the backup checks against a synthetic backup server. Any other argument is passed to `backup_check.py` (e.g., --async)."
+    )
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--apps", type=int, default=3, help="Apps per server")
+    parser.add_argument(
+        "--depth", type=int, default=2, help="Depth of the folder tree of each app"
+    )
+    parser.add_argument(
+        "--fan-out", type=int, default=3, help="Sub-folders per (non-leaf) folder"
+    )
+    parser.add_argument("--files", type=int, default=20, help="Files per folder")
+    parser.add_argument(
+        "--snapshots", type=int, default=3, help="Snapshot folders per server"
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=2.0,
+        help="Latency injected into every remote call",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per check")
+    parser.add_argument(
+        "--json", default=None, metavar="PATH", help="Also write the results to PATH"
+    )
+    shape, check_args = parser.parse_known_args(argv)
+
+    if shape.snapshots < 2:
+        parser.error("--snapshots must be at least 2 (the size checks compare two)")
+
+    options = backup_check.parse_options(check_args)
+
+    # The synthetic backup server is an in-memory filesystem, without a shell
+    if (
+        options.remote_size_days is not None
+        or options.remote_manifest
+        or options.delta is not None
+    ):
+        parser.error(
+            "--remote-size, --remote-manifest and --delta need shell access on the server, which is not simulated"
+        )
+
+    # The checks read their configs from `file_structure/` in the current directory
+    current_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_directory:
+        os.chdir(work_directory)
+        try:
+            results = run_benchmarks(shape, options)
+        finally:
+            os.chdir(current_directory)
+
+    print_results(shape, results)
+
+    if shape.json:
+        with open(shape.json, "w") as file:
+            json.dump(
+                {"shape": vars(shape), "options": vars(options), "results": results},
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,240 @@
+import time
+import threading
+import contextlib
+
+from helper_functions.host_guard import HostUnavailableError, is_host_error
+
+# Smoothed per-call latency (seconds) above which a host is considered busy.
+DEFAULT_TARGET_LATENCY = 1.0
+
+# Maximum number of remote calls in flight per host.
+DEFAULT_MAX_CONCURRENCY = 32
+
+# Number of remote calls allowed in flight per host before any latency is known.
+INITIAL_CONCURRENCY = 4
+
+# Weight of the latest call in the smoothed latency.
+LATENCY_SMOOTHING = 0.2
+
+# Factor the limit of a host is multiplied by when it backs off.
+BACKOFF_FACTOR = 0.5
+
+
+class AdaptiveLimiter:
+    """
+    AIMD (additive increase, multiplicative decrease) limit on the number of remote
+    calls in flight to a single host, like TCP congestion control: while the smoothed
+    per-call latency stays under `target_latency`, the limit grows by about one per
+    `limit` completed calls; when it goes over, or a call fails because of the host
+    (timeout, channel error, ...), the limit is halved, at most once per round trip
+    (the calls already in flight saw the same congestion).
+    """
+
+    def __init__(
+        self,
+        target_latency=DEFAULT_TARGET_LATENCY,
+        max_limit=DEFAULT_MAX_CONCURRENCY,
+        min_limit=1,
+    ):
+        self.target_latency = target_latency
+        self.max_limit = max(max_limit, min_limit)
+        self.min_limit = min_limit
+
+        self.limit = float(min(INITIAL_CONCURRENCY, self.max_limit))
+        self.in_flight = 0
+        self.latency = None
+
+        self._last_backoff = -float("inf")
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+
+            self.in_flight += 1
+
+    def release(self, latency=None, failed=False):
+        """
+        Frees a slot, and adjusts the limit to the `latency` (in seconds) of the call
+        that held it, or to its failure. Calls without a meaningful latency (e.g., a
+        stream) pass None and leave the limit as is.
+        """
+        with self._condition:
+            self.in_flight -= 1
+
+            if latency is not None:
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else (1 - LATENCY_SMOOTHING) * self.latency
+                    + LATENCY_SMOOTHING * latency
+                )
+
+            now = time.monotonic()
+            if failed or (latency is not None and self.latency > self.target_latency):
+                if now - self._last_backoff > (self.latency or 0):
+                    self.limit = max(self.min_limit, self.limit * BACKOFF_FACTOR)
+                    self._last_backoff = now
+            elif latency is not None:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, record_latency=True):
+        """
+        Holds a slot for the enclosed remote call.
+        """
+        self.acquire()
+
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception as exception:
+            # Calls refused by the host guard never reached the host
+            failed = is_host_error(exception) and not isinstance(
+                exception, HostUnavailableError
+            )
+            raise
+        finally:
+            self.release(
+                time.perf_counter() - started_at if record_latency else None, failed
+            )
+
+
+class AdaptiveLimiters:
+    """
+    The adaptive limiter of every host contacted in this process.
+    """
+
+    def __init__(self):
+        self.target_latency = DEFAULT_TARGET_LATENCY
+        self.max_concurrency = DEFAULT_MAX_CONCURRENCY
+
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def configure(self, target_latency=None, max_concurrency=None):
+        if target_latency is not None:
+            self.target_latency = target_latency
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+
+    def get(self, host) -> AdaptiveLimiter:
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveLimiter(
+                    self.target_latency, self.max_concurrency
+                )
+
+            return self._limiters[host]
+
+
+_adaptive_limiters = AdaptiveLimiters()
+
+
+def get_adaptive_limiters() -> AdaptiveLimiters:
+    """
+    Returns the process-wide adaptive limiters.
+    """
+    return _adaptive_limiters
+
+
+@contextlib.contextmanager
+def limited(fs, record_latency=True):
+    """
+    Holds a slot of the adaptive limiter of a (pooled) filesystem for a remote call
+    that does not go through one of its limited methods (e.g., a batched scan). Does
+    nothing for filesystems without a limiter.
+    """
+    limiter = getattr(fs, "limiter", None)
+    if limiter is None:
+        yield
+        return
+
+    with limiter.slot(record_latency):
+        yield
+
+
+class _LimitedFile:
+    """
+    File object wrapper that runs every read and write of a remote file within a slot
+    of the adaptive limiter of its host. The slot is only held during each call, not
+    while the file is open, so files read side by side cannot wait on each other.
+    """
+
+    def __init__(self, file, limiter):
+        self._file = file
+        self._limiter = limiter
+
+    def read(self, *args):
+        with self._limiter.slot(record_latency=False):
+            return self._file.read(*args)
+
+    def readline(self, *args):
+        with self._limiter.slot(record_latency=False):
+            return self._file.readline(*args)
+
+    def write(self, *args):
+        with self._limiter.slot(record_latency=False):
+            return self._file.write(*args)
+
+    def __iter__(self):
+        while line := self.readline():
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._file.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class LimitedFileSystem:
+    """
+    Wrapper around a pooled SSH filesystem that runs every listing, transfer (reads
+    of opened files included) and remote command within a slot of the adaptive
+    limiter of its host. Only the
+    latency of metadata calls (`ls`, `info`, `cat_file`) drives the limit: the time
+    a transfer or a remote command (e.g., `du`, `sha256sum`) takes mostly depends on
+    how much work it does. Every other attribute is delegated to the wrapped
+    filesystem.
+    """
+
+    def __init__(self, fs, limiter):
+        self.fs = fs
+        self.limiter = limiter
+
+    def ls(self, path, *args, **kwargs):
+        with self.limiter.slot():
+            return self.fs.ls(path, *args, **kwargs)
+
+    def info(self, path, **kwargs):
+        with self.limiter.slot():
+            return self.fs.info(path, **kwargs)
+
+    def cat_file(self, path, *args, **kwargs):
+        with self.limiter.slot():
+            return self.fs.cat_file(path, *args, **kwargs)
+
+    def get(self, rpath, lpath, *args, **kwargs):
+        with self.limiter.slot(record_latency=False):
+            return self.fs.get(rpath, lpath, *args, **kwargs)
+
+    def execute(self, command, *args, **kwargs):
+        with self.limiter.slot(record_latency=False):
+            return self.fs.execute(command, *args, **kwargs)
+
+    def open(self, path, *args, **kwargs):
+        with self.limiter.slot():
+            file = self.fs.open(path, *args, **kwargs)
+
+        return _LimitedFile(file, self.limiter)
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
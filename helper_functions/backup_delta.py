@@ -0,0 +1,75 @@
+import heapq
+
+# Number of files with the largest size changes reported per backup folder.
+DEFAULT_TOP_MOVERS = 10
+
+CHANGE_KINDS = ("added", "removed", "grown", "shrunk")
+
+
+def merge_join_file_sizes(previous_files, current_files):
+    """
+    Joins two (path, size) streams sorted by path in a single pass, and yields the
+    (path, previous size, current size) of every file that was added (no previous
+    size), removed (no current size) or changed size. Only the current entry of each
+    stream is held in memory.
+    """
+    previous_files = iter(previous_files)
+    current_files = iter(current_files)
+
+    previous = next(previous_files, None)
+    current = next(current_files, None)
+
+    while previous is not None or current is not None:
+        if current is None or (previous is not None and previous[0] < current[0]):
+            yield previous[0], previous[1], None
+            previous = next(previous_files, None)
+        elif previous is None or current[0] < previous[0]:
+            yield current[0], None, current[1]
+            current = next(current_files, None)
+        else:
+            if previous[1] != current[1]:
+                yield current[0], previous[1], current[1]
+
+            previous = next(previous_files, None)
+            current = next(current_files, None)
+
+
+def get_backup_delta(previous_files, current_files, top_movers=DEFAULT_TOP_MOVERS):
+    """
+    Returns the per-file delta between two snapshots of a backup folder, given their
+    (path, size) streams sorted by path: the number of files and bytes added, removed,
+    grown and shrunk ({kind: [file count, byte delta]}), and the `top_movers` files
+    with the largest absolute size changes as (path, previous size, current size),
+    largest first. Memory does not grow with the number of files: the movers are
+    kept in a heap bounded to `top_movers` entries.
+    """
+    changes = {kind: [0, 0] for kind in CHANGE_KINDS}
+    movers = []
+
+    for index, (path, previous_size, size) in enumerate(
+        merge_join_file_sizes(previous_files, current_files)
+    ):
+        if previous_size is None:
+            kind = "added"
+        elif size is None:
+            kind = "removed"
+        elif size > previous_size:
+            kind = "grown"
+        else:
+            kind = "shrunk"
+
+        delta = (size or 0) - (previous_size or 0)
+        changes[kind][0] += 1
+        changes[kind][1] += delta
+
+        # Min-heap on the absolute delta; the index breaks ties without comparing paths
+        mover = (abs(delta), index, path, previous_size, size)
+        if len(movers) < top_movers:
+            heapq.heappush(movers, mover)
+        elif top_movers:
+            heapq.heappushpop(movers, mover)
+
+    return changes, [
+        (path, previous_size, size)
+        for _, _, path, previous_size, size in sorted(movers, reverse=True)
+    ]
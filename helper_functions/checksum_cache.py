@@ -0,0 +1,77 @@
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_CHECKSUM_CACHE_PATH = ".cache/checksums.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checksums (
+    host TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime TEXT NOT NULL,
+    inode TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    hashed_at REAL NOT NULL,
+    PRIMARY KEY (host, path, size, mtime)
+);
+
+CREATE INDEX IF NOT EXISTS checksums_by_inode ON checksums (host, inode, size, mtime);
+"""
+
+
+class ChecksumCache:
+    """
+    Local SQLite cache of the sha256 checksums of remote files, keyed by host, path,
+    size and modification time, so a file is only hashed again when it changed.
+    Files hard-linked between snapshot folders (same inode, size and mtime) share
+    their checksum, even under a path that was never hashed.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKSUM_CACHE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def get(self, host, path, size, mtime, inode):
+        """
+        Returns the cached checksum of a file, or None if it was never hashed in
+        this state.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sha256 FROM checksums WHERE host = ? AND path = ? AND size = ? AND mtime = ?",
+                (host, path, size, mtime),
+            ).fetchone()
+
+            if row is None:
+                row = self._connection.execute(
+                    "SELECT sha256 FROM checksums WHERE host = ? AND inode = ? AND size = ? AND mtime = ? LIMIT 1",
+                    (host, inode, size, mtime),
+                ).fetchone()
+
+        return row[0] if row else None
+
+    def put_many(self, host, checksums):
+        """
+        Records the (path, size, mtime, inode, sha256) checksums of files of `host`.
+        """
+        hashed_at = time.time()
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (host, path, size, mtime, inode, sha256, hashed_at)
+                    for path, size, mtime, inode, sha256 in checksums
+                ],
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,135 @@
+# Keys every compose service must have when an app does not declare its own rules.
+DEFAULT_REQUIRED_KEYS = ("restart", "labels", "logging")
+
+_MISSING = object()
+
+# Booleans of YAML 1.1, as PyYAML resolves them: an unquoted `restart: no` is parsed
+# as False (but `y` and `n` stay strings).
+_YAML_BOOLEANS = {
+    spelling: normalized
+    for words, normalized in (
+        (("yes", "true", "on"), "true"),
+        (("no", "false", "off"), "false"),
+    )
+    for word in words
+    for spelling in (word, word.capitalize(), word.upper())
+}
+
+
+def normalize_scalar(value):
+    """
+    Returns a scalar of a compose file or of a rule as a string, the way it reads in
+    the YAML source, so that `no`, `"no"` and False (or 1 and "1") compare equal.
+    Other values (e.g., mappings) are returned as-is.
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str):
+        return _YAML_BOOLEANS.get(value, value)
+
+    return value
+
+
+def get_path(value, path):
+    """
+    Returns the value at a (pre-split) nested key path of a parsed compose service,
+    or `_MISSING` if any key along the path is absent.
+    """
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+
+    return value
+
+
+class ComposeRuleResults:
+    """
+    Outcome of evaluating the rules of an app against its merged compose services:
+    the services missing each required key path, the services using each forbidden
+    (key path, value) pair, and the services without any keys.
+    """
+
+    __slots__ = ("missing_keys", "forbidden_values", "empty_services")
+
+    def __init__(self, missing_keys, forbidden_values, empty_services):
+        self.missing_keys = missing_keys
+        self.forbidden_values = forbidden_values
+        self.empty_services = empty_services
+
+
+class ComposeRules:
+    """
+    Compiled compose rules of an app, as declared under its "rules" key in
+    `app_server_docker_config_keys.json`:
+
+    * "required-keys": key paths every service must have; nested keys are separated
+      by "." (e.g., "logging.driver"). Defaults to `DEFAULT_REQUIRED_KEYS`.
+    * "forbidden-values": {key path: [values]} no service may use (e.g.,
+      {"restart": ["no"], "logging.driver": ["none"], "privileged": [true]}). Scalars
+      are compared as strings (see `normalize_scalar`), so a rule matches whether the
+      compose file quotes the value or not.
+    """
+
+    def __init__(self, required_keys=DEFAULT_REQUIRED_KEYS, forbidden_values=None):
+        # Key paths are split once, not once per service
+        self.required_keys = [(key, tuple(key.split("."))) for key in required_keys]
+        self.forbidden_values = [
+            (
+                key,
+                tuple(key.split(".")),
+                [(value, normalize_scalar(value)) for value in values],
+            )
+            for key, values in (forbidden_values or {}).items()
+        ]
+
+    @classmethod
+    def from_config(cls, app_config):
+        rules = app_config.get("rules", {})
+
+        return cls(
+            rules.get("required-keys", DEFAULT_REQUIRED_KEYS),
+            rules.get("forbidden-values"),
+        )
+
+    def evaluate(self, config_object) -> ComposeRuleResults:
+        """
+        Evaluates every rule in a single pass over the services of a (merged) compose
+        config.
+        """
+        missing_keys = {key: [] for key, _ in self.required_keys}
+        forbidden_values = {
+            (key, value): []
+            for key, _, values in self.forbidden_values
+            for value, _ in values
+        }
+        empty_services = []
+
+        for service, service_config in (config_object.get("services") or {}).items():
+            if not isinstance(service_config, dict):
+                empty_services.append(service)
+                continue
+
+            for key, path in self.required_keys:
+                if get_path(service_config, path) is _MISSING:
+                    missing_keys[key].append(service)
+
+            for key, path, values in self.forbidden_values:
+                value = get_path(service_config, path)
+                if value is _MISSING:
+                    continue
+
+                # For lists (e.g., `cap_add`), any forbidden item counts
+                used_values = [
+                    normalize_scalar(used_value)
+                    for used_value in (value if isinstance(value, list) else [value])
+                ]
+                for forbidden_value, normalized_value in values:
+                    if normalized_value in used_values:
+                        forbidden_values[(key, forbidden_value)].append(service)
+
+        return ComposeRuleResults(missing_keys, forbidden_values, empty_services)
@@ -0,0 +1,138 @@
+import threading
+
+from helper_functions.adaptive_limiter import LimitedFileSystem, get_adaptive_limiters
+from helper_functions.host_guard import GuardedFileSystem, get_host_guard
+from helper_functions.instrumentation import InstrumentedFileSystem, get_profiler, track
+
+
+class ConnectionPool:
+    """
+    Host-keyed pool of SSH connections shared by every script running in the same
+    process. Each (host, user) pair gets a single `SSHFileSystem`, whose underlying
+    asyncssh connection serves both the SFTP channels (fsspec calls such as `ls`,
+    `get` and `open`) and the exec channels (`execute`), so the SSH handshake and
+    agent forwarding setup only happen once per host.
+    """
+
+    def __init__(self):
+        # Passed to every new connection, unless overridden by the caller
+        self.default_connect_kwargs = {}
+
+        self._filesystems = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+
+    def filesystem(self, host, user, **connect_kwargs):
+        """
+        Returns the filesystem connected to `host` as `user`, connecting on first use.
+        `connect_kwargs` are passed to `SSHFileSystem` (and from there to
+        `asyncssh.connect`) and are only used when the connection is established.
+
+        Connecting is bounded by the connect timeout of the host guard, and every
+        remote operation of the returned filesystem by its operation timeout (see
+        `helper_functions.host_guard`). A host that could not be connected to is not
+        tried again in the same run. The number of remote operations in flight to
+        the host is adapted to its latency (see `helper_functions.adaptive_limiter`).
+        When profiling is enabled, the returned filesystem also records every remote
+        operation (see `helper_functions.instrumentation`).
+        """
+        key = (host, user)
+        host_guard = get_host_guard()
+
+        # Connect to different hosts in parallel, but never twice to the same one.
+        with self._lock:
+            host_lock = self._host_locks.setdefault(key, threading.Lock())
+
+        with host_lock:
+            if key not in self._filesystems:
+                # sshfs (and asyncssh) are only imported once a connection is needed
+                from sshfs import SSHFileSystem
+
+                host_guard.check(host)
+
+                try:
+                    with track(host, "connect"):
+                        self._filesystems[key] = SSHFileSystem(
+                            host,
+                            username=user,
+                            **{
+                                "connect_timeout": host_guard.get_timeout(
+                                    host_guard.connect_timeout
+                                ),
+                                **self.default_connect_kwargs,
+                                **connect_kwargs,
+                            },
+                        )
+                except Exception as exception:
+                    host_guard.record_failure(host, exception, open_circuit=True)
+                    raise
+
+            fs = LimitedFileSystem(
+                GuardedFileSystem(self._filesystems[key], host, host_guard),
+                get_adaptive_limiters().get(host),
+            )
+
+        if get_profiler() is not None:
+            return InstrumentedFileSystem(fs, host)
+
+        return fs
+
+    def discard(self, host):
+        """
+        Closes the pooled connections to `host` (e.g., after one dropped), so the next
+        `filesystem` call connects again.
+        """
+        with self._lock:
+            filesystems = [
+                self._filesystems.pop(key)
+                for key in list(self._filesystems)
+                if key[0] == host
+            ]
+
+        if not filesystems:
+            return
+
+        for fs in filesystems:
+            fs.loop.call_soon_threadsafe(fs.client.close)
+
+        # fsspec caches filesystem instances; make sure closed ones are not reused.
+        type(filesystems[0]).clear_instance_cache()
+
+    def close(self):
+        """
+        Closes every pooled connection.
+        """
+        with self._lock:
+            filesystems = list(self._filesystems.values())
+            self._filesystems.clear()
+            self._host_locks.clear()
+
+        if not filesystems:
+            return
+
+        for fs in filesystems:
+            fs.loop.call_soon_threadsafe(fs.client.close)
+
+        # fsspec caches filesystem instances; make sure closed ones are not reused.
+        type(filesystems[0]).clear_instance_cache()
+
+
+_connection_pool = ConnectionPool()
+
+
+def get_connection_pool() -> ConnectionPool:
+    """
+    Returns the process-wide connection pool.
+    """
+    return _connection_pool
+
+
+def app_server_filesystem(server_config):
+    """
+    Returns the pooled filesystem of an app server entry from one of the
+    `file_structure/app_servers` configs. The SSH agent is forwarded, as it was for
+    the fabric connections used previously.
+    """
+    return get_connection_pool().filesystem(
+        server_config["host"], server_config["user"], agent_forwarding=True
+    )
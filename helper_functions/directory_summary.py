@@ -0,0 +1,310 @@
+import os
+import re
+import stat
+import shlex
+import asyncio
+
+from helper_functions.adaptive_limiter import limited
+from helper_functions.host_guard import check_host
+from helper_functions.instrumentation import track
+
+# Entry types reported by `find -printf %y`
+_FIND_KINDS = {"f": "file", "d": "directory"}
+
+# Error message of `find` (in the C locale) about a path it could not read
+_FIND_ERROR_PATTERN = re.compile(r"^find: '(.*)': [^']*$")
+
+
+class DirectorySummary:
+    """
+    What the content checks need to know about a folder: the names of its files and
+    sub-folders, and a histogram of its files per extension ({extension: [count,
+    bytes]}). `files` and `histogram` may be None when they were not requested, and
+    `listing` holds the fsspec style listing of the folder, unless it was streamed.
+    """
+
+    __slots__ = ("files", "folders", "histogram", "listing")
+
+    def __init__(self, files, folders, histogram=None, listing=None):
+        self.files = files
+        self.folders = folders
+        self.histogram = histogram
+        self.listing = listing
+
+
+def get_extension(file_name, expected_extensions=frozenset()) -> str:
+    """
+    Returns the extension of a file name (without the leading "."). The longest
+    expected extension the name ends with wins (e.g., "sql.gz" for "dump.sql.gz"),
+    otherwise the last suffix is used, so the result does not depend on how many dots
+    the name has.
+    """
+    dot = file_name.find(".", 1)
+    while dot != -1:
+        if file_name[dot + 1 :] in expected_extensions:
+            return file_name[dot + 1 :]
+        dot = file_name.find(".", dot + 1)
+
+    _, dot, extension = file_name[1:].rpartition(".")
+
+    return extension if dot else ""
+
+
+class _SummaryBuilder:
+    """
+    Accumulates directory entries into a `DirectorySummary` with bounded memory: file
+    names are only kept when `keep_files` is set, and extensions only feed counters.
+    With `keep_listing`, an fsspec style listing of `folder` is rebuilt as well.
+    """
+
+    def __init__(self, expected_extensions, keep_files, folder=None, keep_listing=False):
+        self.expected_extensions = (
+            frozenset(extension.lstrip(".") for extension in expected_extensions)
+            if expected_extensions is not None
+            else None
+        )
+        self.files = set() if keep_files else None
+        self.folders = set()
+        self.histogram = {} if expected_extensions is not None else None
+        self.folder = folder
+        self.listing = [] if keep_listing else None
+
+    def add(self, name, kind, size):
+        if self.listing is not None:
+            self.listing.append(
+                {"name": f"{self.folder}/{name}", "type": kind, "size": size}
+            )
+
+        if kind == "directory":
+            self.folders.add(name)
+            return
+
+        # Links and special files are left out, like in the fsspec based checks
+        if kind != "file":
+            return
+
+        if self.files is not None:
+            self.files.add(name)
+
+        if self.histogram is not None:
+            counts = self.histogram.setdefault(
+                get_extension(name, self.expected_extensions), [0, 0]
+            )
+            counts[0] += 1
+            counts[1] += size or 0
+
+    def build(self, listing=None) -> DirectorySummary:
+        return DirectorySummary(
+            frozenset(self.files) if self.files is not None else None,
+            frozenset(self.folders),
+            self.histogram,
+            listing if listing is not None else self.listing,
+        )
+
+
+def summarize_listing(folder_listing, expected_extensions=None) -> DirectorySummary:
+    """
+    Builds the summary of a folder from its fsspec `ls(..., detail=True)` listing.
+    """
+    builder = _SummaryBuilder(expected_extensions, keep_files=True)
+
+    for detail in folder_listing:
+        builder.add(detail["name"].split("/")[-1], detail["type"], detail.get("size"))
+
+    return builder.build(folder_listing)
+
+
+def _get_kind(mode) -> str:
+    # Same file types as the "type" of an fsspec listing entry
+    if stat.S_ISDIR(mode or 0):
+        return "directory"
+    if stat.S_ISREG(mode or 0):
+        return "file"
+    return "other"
+
+
+async def _scan_sftp_directory(fs, path, builder, counters):
+    # sshfs keeps a pool of SFTP channels; asyncssh's `scandir` yields the entries as
+    # the READDIR responses arrive, so the whole listing is never held in memory.
+    async with fs._pool.get() as channel:
+        async for entry in channel.scandir(path):
+            if entry.filename in (".", ".."):
+                continue
+
+            counters["items"] += 1
+            builder.add(
+                entry.filename, _get_kind(entry.attrs.permissions), entry.attrs.size
+            )
+
+
+def scan_directory(fs, path, expected_extensions=None, keep_files=False):
+    """
+    Streams the entries of a folder into a `DirectorySummary` without materialising
+    the full listing: SFTP READDIR chunks for sshfs filesystems, `os.scandir` for local
+    ones. Other filesystems fall back to a regular listing.
+    """
+    builder = _SummaryBuilder(expected_extensions, keep_files)
+
+    if hasattr(fs, "_pool") and hasattr(fs, "loop"):
+        from fsspec.asyn import sync
+
+        check_host(fs)
+
+        # A streamed listing holds a slot of the host's limiter, but its duration
+        # depends on the size of the folder, so it does not drive the limit
+        with limited(fs, record_latency=False), track(
+            getattr(fs, "host", "remote"), "scandir"
+        ) as counters:
+            # Bounded like the other operations of a guarded filesystem
+            sync(
+                fs.loop,
+                _scan_sftp_directory,
+                fs,
+                path,
+                builder,
+                counters,
+                timeout=getattr(fs, "operation_timeout", None),
+            )
+    elif getattr(fs, "protocol", None) in ("file", ("file", "local")):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                entry_stat = entry.stat(follow_symlinks=False)
+                builder.add(
+                    entry.name, _get_kind(entry_stat.st_mode), entry_stat.st_size
+                )
+    else:
+        for detail in fs.ls(path, detail=True):
+            builder.add(
+                detail["name"].split("/")[-1], detail["type"], detail.get("size")
+            )
+
+    return builder.build()
+
+
+def _get_unreadable_folders(errors, root):
+    """
+    Returns the folders (relative to `root`) `find` reported errors about, or None if
+    an error cannot be attributed to a folder under `root`.
+    """
+    unreadable_folders = set()
+    for line in errors.splitlines():
+        match = _FIND_ERROR_PATTERN.match(line)
+        if match is None:
+            return None
+
+        path = match.group(1)
+        if path == root:
+            unreadable_folders.add("")
+        elif path.startswith(f"{root}/"):
+            unreadable_folders.add(path[len(root) + 1 :])
+        else:
+            return None
+
+    return unreadable_folders
+
+
+async def _scan_remote_tree(fs, root, builders, max_depth, counters):
+    # NUL-terminated records, so that any file name can be parsed back
+    find_format = r"%y\t%s\t%P\0"
+    command = f"LC_ALL=C find {shlex.quote(root)} -maxdepth {max_depth} -printf {shlex.quote(find_format)}"
+
+    existing_folders = set()
+
+    async with fs.client.create_process(command) as process:
+        # Read alongside stdout, so a long error output cannot stall the channel
+        errors = asyncio.ensure_future(process.stderr.read())
+
+        while True:
+            try:
+                record = await process.stdout.readuntil("\0")
+            except asyncio.IncompleteReadError:
+                break
+
+            counters["bytes"] += len(record)
+            counters["items"] += 1
+
+            kind, size, path = record[:-1].split("\t", 2)
+            if kind == "d":
+                existing_folders.add(path)
+
+            # Only the direct entries of expected folders are kept
+            parent, _, name = path.rpartition("/")
+            if path and parent in builders:
+                builders[parent].add(name, _FIND_KINDS.get(kind, "other"), int(size))
+
+        await process.wait()
+        errors = await errors
+
+    # `find` still reports a folder it cannot read (e.g., no permission), just not its
+    # entries. Such folders are left out, so they are listed over SFTP instead of
+    # being checked as empty; if the errors cannot be told apart, none is kept.
+    if process.exit_status != 0:
+        unreadable_folders = _get_unreadable_folders(errors, root)
+        if unreadable_folders is None:
+            return set()
+
+        existing_folders -= unreadable_folders
+
+    return existing_folders
+
+
+def scan_remote_tree(fs, root, nodes_by_folder) -> dict:
+    """
+    Builds the `DirectorySummary` of every expected folder under `root` from a single
+    remote `find` call, streamed back over an exec channel of the SSH connection,
+    instead of one SFTP listing per folder. `nodes_by_folder` maps folder paths to
+    their compiled expectation nodes. Folders outside `root`, missing on the server or
+    that `find` could not read are left out of the result; filesystems without an SSH
+    client yield no summaries.
+    """
+    if not hasattr(fs, "client") or not hasattr(fs, "loop"):
+        return {}
+
+    builders = {}
+    for folder, node in nodes_by_folder.items():
+        if folder == root:
+            relative_folder = ""
+        elif folder.startswith(f"{root}/"):
+            relative_folder = folder[len(root) + 1 :]
+        else:
+            continue
+
+        builders[relative_folder] = _SummaryBuilder(
+            node.expected_extensions,
+            keep_files=node.expected_extensions is None
+            or node.expected_files is not None,
+            folder=folder,
+            # Folders checked for extensions only can hold a huge number of files
+            keep_listing=node.expected_extensions is None,
+        )
+
+    if not builders:
+        return {}
+
+    max_depth = max(
+        relative_folder.count("/") + 2 if relative_folder else 1
+        for relative_folder in builders
+    )
+    from fsspec.asyn import sync
+
+    check_host(fs)
+
+    with limited(fs, record_latency=False), track(
+        getattr(fs, "host", "remote"), "exec:find"
+    ) as counters:
+        existing_folders = sync(
+            fs.loop,
+            _scan_remote_tree,
+            fs,
+            root,
+            builders,
+            max_depth,
+            counters,
+            timeout=getattr(fs, "operation_timeout", None),
+        )
+
+    return {
+        builder.folder: builder.build()
+        for relative_folder, builder in builders.items()
+        if relative_folder in existing_folders
+    }
@@ -0,0 +1,78 @@
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+from datetime import datetime
+
+DEFAULT_DOCUMENT_CACHE_PATH = ".cache/documents.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    location TEXT PRIMARY KEY,
+    version BLOB NOT NULL,
+    document BLOB NOT NULL
+);
+"""
+
+# Returned by `DocumentCache.get` on a miss, since None is a valid document (e.g., an
+# empty YAML file).
+CACHE_MISS = object()
+
+
+def get_file_version(info) -> tuple:
+    """
+    Returns the (mtime, size) pair of an fsspec `info()` result, used to tell whether a
+    remote file changed since it was last fetched.
+    """
+    mtime = info.get("mtime")
+    if isinstance(mtime, datetime):
+        mtime = mtime.timestamp()
+
+    return mtime, info.get("size")
+
+
+class DocumentCache:
+    """
+    Local SQLite cache of parsed documents (e.g., docker compose files), keyed by
+    remote location and file version (mtime and size). Unchanged files are neither
+    downloaded nor parsed again. SQLite lets the workers of a sharded run (`run.py
+    --workers`) share the cache.
+
+    Every lookup returns a fresh copy of the cached document, so callers may mutate it.
+    """
+
+    def __init__(self, path=DEFAULT_DOCUMENT_CACHE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def get(self, location, version):
+        """
+        Returns the cached document of a location for the given file version, or
+        `CACHE_MISS`.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT version, document FROM documents WHERE location = ?",
+                (location,),
+            ).fetchone()
+
+        if row is None or pickle.loads(row[0]) != version:
+            return CACHE_MISS
+
+        return pickle.loads(row[1])
+
+    def put(self, location, version, document):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?)",
+                (location, pickle.dumps(version), pickle.dumps(document)),
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,98 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+from pathlib import Path
+
+DEFAULT_EXPECTATION_CACHE_DIR = ".cache/expectations"
+
+
+class ExpectationNode:
+    """
+    Compiled form of a folder entry of a `file_structure/*.json` config.
+    """
+
+    __slots__ = (
+        "name",
+        "path",
+        "expected_files",
+        "expected_extensions",
+        "folders",
+        "children",
+    )
+
+    def __init__(self, name, node_file_structure):
+        self.name = name
+        self.path = node_file_structure["path"]
+
+        # None means the config does not list the expected files/extensions of the folder
+        self.expected_files = (
+            frozenset(node_file_structure["expected-files"])
+            if "expected-files" in node_file_structure
+            else None
+        )
+        # Extensions keep their config order, which is the order they are reported in
+        self.expected_extensions = (
+            tuple(node_file_structure["expected-file-extensions"])
+            if "expected-file-extensions" in node_file_structure
+            else None
+        )
+
+        # Sub-folders are the json dictionary keys of the folder
+        self.children = tuple(
+            ExpectationNode(item, value)
+            for item, value in node_file_structure.items()
+            if isinstance(value, dict)
+        )
+        self.folders = frozenset(child.name for child in self.children)
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+
+def compile_expectation_tree(server_filesystem_structure) -> dict:
+    """
+    Compiles a server/app content config into a {server: {app: ExpectationNode}} mapping.
+    """
+    return {
+        server: {
+            app: ExpectationNode(app, node_file_structure)
+            for app, node_file_structure in server_filesystem_structure[server][
+                "applications"
+            ].items()
+        }
+        for server in server_filesystem_structure
+    }
+
+
+def load_expectation_tree(config_path, cache_dir=DEFAULT_EXPECTATION_CACHE_DIR) -> dict:
+    """
+    Returns the compiled expectation tree of a config file. The compiled form is cached
+    on disk, keyed by the hash of the config file, so it is only rebuilt when the
+    config changes.
+    """
+    config = Path(config_path).read_bytes()
+    cache_path = Path(cache_dir) / f"{hashlib.sha256(config).hexdigest()}.pickle"
+
+    if cache_path.exists():
+        with open(cache_path, "rb") as file:
+            return pickle.load(file)
+
+    expectation_tree = compile_expectation_tree(json.loads(config))
+
+    # Written next to the cache file first (under a unique name, as workers may
+    # compile the same config at the same time), so a reader never loads a truncated
+    # pickle
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=cache_path.parent, suffix=".tmp", delete=False
+    ) as file:
+        pickle.dump(expectation_tree, file)
+    os.replace(file.name, cache_path)
+
+    return expectation_tree
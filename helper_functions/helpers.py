@@ -1,196 +1,302 @@
 import re
+import shlex
 import collections
+from concurrent.futures import ThreadPoolExecutor
 
 import humanize
 from termcolor import colored
 
+from helper_functions.directory_summary import (
+    scan_directory,
+    scan_remote_tree,
+    summarize_listing,
+)
+from helper_functions.adaptive_limiter import limited
+from helper_functions.host_guard import check_host
+from helper_functions.instrumentation import track
+
+# Number of bytes read at a time from the output of a streamed remote command.
+REMOTE_STREAM_CHUNK_SIZE = 256 * 1024
+
 #
 # Helper Functions
 #
 
 
-def get_latest_folder_and_timestamp(backup_folder_list) -> tuple[str, str]:
-    # Get the directory with the latest timestamp.
-    # We take the second entry in the list since the first
-    # one is occupied by a non-timestamped folder.
-    latest_directory_backup = sorted(
-        backup_folder_list, key=lambda backup: backup[0], reverse=True
-    )[1]
-
-    # An example backup time is: data_backup_20240117T054501.
-    # We first split on '_' and get the last element to return 20240117T054501.
-    latest_directory_backup_timestamp = latest_directory_backup[0].split("_")[-1]
-
-    return latest_directory_backup[0], latest_directory_backup_timestamp
-
-
-def get_nth_folder_and_timestamp(backup_folder_list, index) -> tuple[str, str]:
-    # Get the directory with the latest timestamp.
-    # We take the second entry in the list since the first
-    # one in the list is "data_incremental_backup".
-    latest_directory_backup = sorted(
-        backup_folder_list, key=lambda backup: backup[0], reverse=True
-    )[index]
-
-    # An example backup time is: data_backup_20240117T054501.
-    # We first split on '_' and return the last element to get
-    # 20240117T054501.
-    latest_directory_backup_timestamp = latest_directory_backup[0].split("_")[-1]
-
-    return latest_directory_backup[0], latest_directory_backup_timestamp
+def get_directory_summary(
+    fs, node, current_folder, stream_extensions=False, summaries=None
+):
+    """
+    Returns the `DirectorySummary` of the folder of a compiled node, taken from the
+    prefetched `summaries` if it is there. With `stream_extensions`, folders that are
+    only checked for file extensions are streamed (see `scan_directory`) instead of
+    fully listed, which keeps memory bounded for folders with hundreds of thousands
+    of files.
+    """
+    if summaries and current_folder in summaries:
+        return summaries[current_folder]
+
+    if stream_extensions and node.expected_extensions is not None:
+        return scan_directory(
+            fs,
+            current_folder,
+            node.expected_extensions,
+            keep_files=node.expected_files is not None,
+        )
+
+    return summarize_listing(
+        fs.ls(f"{current_folder}", detail=True), node.expected_extensions
+    )
 
 
-def server_app_folder_content_check(
-    fs, server_filesystem_structure, server, app, latest_timestamp_folder=""
-) -> bool:
+def iter_expected_tree(root_node):
     """
-    Check the content of each app folder
+    Yields the nodes of a compiled expected folder tree in breadth-first order.
     """
-    root_folder = f"{latest_timestamp_folder}"
-
-    queue = collections.deque(
-        [server_filesystem_structure[server]["applications"][app]]
-    )
+    queue = collections.deque([root_node])
 
     while queue:
-        node_file_structure = queue.popleft()
+        node = queue.popleft()
+        queue.extend(node.children)
 
-        current_folder = f"{root_folder}/{node_file_structure["path"]}"
+        yield node
 
-        # Perform file check for current level
-        if "expected-files" in node_file_structure.keys():
-            item = "expected-files"
 
-            actual_files = [
-                detail["name"].split("/")[-1]
-                for detail in fs.ls(
-                    f"{current_folder}",
-                    detail=True,
+def walk_expected_tree(
+    fs,
+    root_node,
+    root_folder,
+    max_in_flight=1,
+    stream_extensions=False,
+    summaries=None,
+    selected_paths=None,
+):
+    """
+    Walks the compiled expected folder tree breadth-first and yields a
+    (node, folder path, directory summary) tuple for every node (or, if given, only
+    for the nodes whose config path is in `selected_paths`).
+
+    Since the expected tree is known up front (it comes from the json config), the
+    listing of a node does not depend on the listing of its parent. With
+    `max_in_flight` > 1, up to that many listings are kept in flight on a thread
+    pool ahead of the node currently being yielded, so wall time no longer grows
+    with one round trip per node. Nodes are still yielded in breadth-first order.
+    """
+    queue = collections.deque([root_node])
+
+    if selected_paths is not None:
+        queue = collections.deque(
+            node for node in iter_expected_tree(root_node) if node.path in selected_paths
+        )
+
+    def next_node():
+        node = queue.popleft()
+
+        # Append sub-folders to a queue for processing (the selected nodes are
+        # already all queued, in breadth-first order).
+        if selected_paths is None:
+            queue.extend(node.children)
+
+        return node, f"{root_folder}/{node.path}"
+
+    if max_in_flight <= 1:
+        while queue:
+            node, current_folder = next_node()
+            yield node, current_folder, get_directory_summary(
+                fs, node, current_folder, stream_extensions, summaries
+            )
+        return
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = collections.deque()
+
+        while queue or in_flight:
+            # Top up the window of in-flight listings
+            while queue and len(in_flight) < max_in_flight:
+                node, current_folder = next_node()
+                in_flight.append(
+                    (
+                        node,
+                        current_folder,
+                        executor.submit(
+                            get_directory_summary,
+                            fs,
+                            node,
+                            current_folder,
+                            stream_extensions,
+                            summaries,
+                        ),
+                    )
                 )
-                if detail["type"] == "file"
-            ]
 
-            if sorted(node_file_structure[item]) != sorted(actual_files):
-                print(
-                    f"❌ Mismatch between actual and expected files in {colored(current_folder, "blue")} for {colored(app, "cyan")}:\n"
-                )
-                print(f"* {colored("Actual files:", "red")} {sorted(actual_files)}")
-                print(
-                    f"* {colored("Expected files:", "green")} {sorted(node_file_structure[item])}\n"
-                )
+            node, current_folder, summary = in_flight.popleft()
+            yield node, current_folder, summary.result()
 
-                missing_files = [
-                    folder
-                    for folder in sorted(sorted(node_file_structure[item]))
-                    if folder not in sorted(actual_files)
-                ]
-                unexpected_files = [
-                    folder
-                    for folder in sorted(actual_files)
-                    if folder not in sorted(sorted(node_file_structure[item]))
-                ]
-
-                if missing_files:
-                    print(
-                        f"{colored("These files were expected, but are not currently present:", "yellow")} {missing_files}\n"
-                    )
 
-                if unexpected_files:
-                    print(
-                        f"{colored("These files were NOT expected, but are currently present:", "yellow", attrs=["reverse"])} {unexpected_files}\n"
-                    )
-                # return False
-            else:
+def check_folder_content(node, current_folder, summary, app) -> bool:
+    """
+    Runs the expected-files, expected-file-extensions and folder checks of a single
+    compiled node against the summary of its folder, and returns whether they all
+    passed. Each check is a single set difference; lists are only sorted to report a
+    mismatch.
+    """
+    check_passed = True
+
+    actual_files = summary.files
+    actual_folders = summary.folders
+
+    # Perform file check for current level
+    if node.expected_files is not None:
+        if node.expected_files != actual_files:
+            print(
+                f"❌ Mismatch between actual and expected files in {colored(current_folder, "blue")} for {colored(app, "cyan")}:\n"
+            )
+            print(f"* {colored("Actual files:", "red")} {sorted(actual_files)}")
+            print(
+                f"* {colored("Expected files:", "green")} {sorted(node.expected_files)}\n"
+            )
+
+            missing_files = sorted(node.expected_files - actual_files)
+            unexpected_files = sorted(actual_files - node.expected_files)
+
+            if missing_files:
                 print(
-                    f"✅ Actual files and expected files match up in {colored(current_folder, "blue")} for {colored(app, "cyan")}.\n"
+                    f"{colored("These files were expected, but are not currently present:", "yellow")} {missing_files}\n"
                 )
 
-        if "expected-file-extensions" in node_file_structure.keys():
-            actual_backup_files = [
-                (detail["name"].split("/")[-1], detail["size"])
-                for detail in fs.ls(
-                    f"{current_folder}",
-                    detail=True,
-                )
-                if detail["type"] == "file"
-            ]
-
-            extension_file_count = dict()
-            for extension in node_file_structure["expected-file-extensions"]:
-                extension_file_count[extension] = len(
-                    [
-                        name
-                        for name, _ in actual_backup_files
-                        if name.split(".", 1)[-1] == extension
-                    ]
+            if unexpected_files:
+                print(
+                    f"{colored("These files were NOT expected, but are currently present:", "yellow", attrs=["reverse"])} {unexpected_files}\n"
                 )
-
-            if sorted(extension_file_count.keys()) == sorted(
-                node_file_structure["expected-file-extensions"]
-            ):
-                for key in extension_file_count.keys():
-                    print(
-                        f"* Found {extension_file_count[key]} .{key} files in {colored(current_folder, "blue")} for {colored(app, "cyan")}.\n"
-                    )
-            else:
-                print("There was an extension mismatch!\n")
-
-        # Perform folder check for current level
-        expected_folders = [
-            item
-            for item in node_file_structure.keys()
-            if isinstance(node_file_structure[item], dict)
-        ]
-
-        actual_folders = [
-            detail["name"].split("/")[-1]
-            for detail in fs.ls(f"{current_folder}", detail=True)
-            if detail["type"] == "directory"
+            check_passed = False
+        else:
+            print(
+                f"✅ Actual files and expected files match up in {colored(current_folder, "blue")} for {colored(app, "cyan")}.\n"
+            )
+
+    if node.expected_extensions is not None:
+        # The histogram ({extension: [count, bytes]}) was built in a single pass
+        # over the folder's entries.
+        expected_extensions = [
+            extension.lstrip(".") for extension in node.expected_extensions
         ]
 
-        if expected_folders and actual_folders:
-            if sorted(expected_folders) != sorted(actual_folders):
+        for extension in expected_extensions:
+            file_count, total_size = summary.histogram.get(extension, (0, 0))
+            print(
+                f"* Found {file_count} .{extension} files ({get_humanized_size(total_size)[1]}) in {colored(current_folder, "blue")} for {colored(app, "cyan")}.\n"
+            )
+
+        other_extensions = {
+            f".{extension}" if extension else "(no extension)": file_count
+            for extension, (file_count, _) in sorted(summary.histogram.items())
+            if extension not in expected_extensions
+        }
+        if other_extensions:
+            print(
+                f"{colored("Files with other extensions are also present:", "yellow")} {other_extensions}\n"
+            )
+
+    # Perform folder check for current level
+    if node.folders and actual_folders:
+        if node.folders != actual_folders:
+            print(
+                f"❌ Mismatch between actual and expected folders in {colored(current_folder, "blue")} for {colored(app, "cyan")}:\n"
+            )
+            print(f"* {colored("Actual folders:", "red")} {sorted(actual_folders)}")
+            print(
+                f"* {colored("Expected folders:", "green")} {sorted(node.folders)}\n"
+            )
+
+            missing_folders = sorted(node.folders - actual_folders)
+            unexpected_folders = sorted(actual_folders - node.folders)
+
+            if missing_folders:
                 print(
-                    f"❌ Mismatch between actual and expected folders in {colored(current_folder, "blue")} for {colored(app, "cyan")}:\n"
-                )
-                print(f"* {colored("Actual folders:", "red")} {sorted(actual_folders)}")
-                print(
-                    f"* {colored("Expected folders:", "green")} {sorted(expected_folders)}\n"
+                    f"{colored("These folders were expected, but are not currently present:", "yellow")} {missing_folders}\n"
                 )
 
-                missing_folders = [
-                    folder
-                    for folder in sorted(expected_folders)
-                    if folder not in sorted(actual_folders)
-                ]
-                unexpected_folders = [
-                    folder
-                    for folder in sorted(actual_folders)
-                    if folder not in sorted(expected_folders)
-                ]
-
-                if missing_folders:
-                    print(
-                        f"{colored("These folders were expected, but are not currently present:", "yellow")} {missing_folders}\n"
-                    )
-
-                if unexpected_folders:
-                    print(
-                        f"{colored("These folders were NOT expected, but are currently present:", "yellow", attrs=["reverse"])} {unexpected_folders}\n"
-                    )
-                # return False
-            else:
+            if unexpected_folders:
                 print(
-                    f"✅ Actual folders and expected folders match up in {colored(current_folder, "blue")} for {colored(app, "cyan")}.\n"
+                    f"{colored("These folders were NOT expected, but are currently present:", "yellow", attrs=["reverse"])} {unexpected_folders}\n"
                 )
+            check_passed = False
+        else:
+            print(
+                f"✅ Actual folders and expected folders match up in {colored(current_folder, "blue")} for {colored(app, "cyan")}.\n"
+            )
 
-        # Append folders (e.g., json dictionary keys) to a queue
-        # for processing.
-        for item in node_file_structure.keys():
-            if isinstance(node_file_structure[item], dict):
-                queue.append(node_file_structure[item])
+    return check_passed
 
-    return True
+
+def server_app_folder_content_check(
+    fs,
+    expectation_tree,
+    server,
+    app,
+    latest_timestamp_folder="",
+    max_in_flight=1,
+    listing_callback=None,
+    stream_extensions=False,
+    remote_manifest=False,
+    sampler=None,
+) -> bool:
+    """
+    Check the content of each app folder against the compiled expectation tree (see
+    `helper_functions.expectation_tree`), and return whether every folder matched.
+    If given, `listing_callback` is called with the (config) path and the listing of
+    every checked folder (None if the folder was not fully listed, e.g., with
+    `stream_extensions`).
+
+    With `remote_manifest`, the whole app folder is fetched with a single remote
+    `find` call first (see `scan_remote_tree`); folders it does not cover are listed
+    over SFTP as usual.
+
+    With a `sampler` (see `helper_functions.tree_sampler`), only the folders it
+    selects for this run are checked.
+    """
+    root_folder = f"{latest_timestamp_folder}"
+    root_node = expectation_tree[server][app]
+
+    selected_paths = None
+    if sampler is not None:
+        selected_paths = sampler.select(server, app, root_node)
+
+    summaries = None
+    if remote_manifest:
+        summaries = scan_remote_tree(
+            fs,
+            f"{root_folder}/{root_node.path}",
+            {
+                f"{root_folder}/{node.path}": node
+                for node in iter_expected_tree(root_node)
+                if selected_paths is None or node.path in selected_paths
+            },
+        )
+
+    checked_paths = []
+    check_passed = True
+
+    for node, current_folder, summary in walk_expected_tree(
+        fs,
+        root_node,
+        root_folder,
+        max_in_flight,
+        stream_extensions,
+        summaries,
+        selected_paths,
+    ):
+        if not check_folder_content(node, current_folder, summary, app):
+            check_passed = False
+        checked_paths.append(node.path)
+
+        if listing_callback is not None:
+            listing_callback(node.path, summary.listing)
+
+    if sampler is not None:
+        sampler.mark_checked(server, app, checked_paths)
+
+    return check_passed
 
 
 def get_folder_size(input_list):
@@ -200,22 +306,210 @@ def get_folder_size(input_list):
     """
     total_size_in_bytes = sum(size for _, size in input_list)
 
-    return (total_size_in_bytes, humanize.naturalsize(total_size_in_bytes, gnu=True))
+    return get_humanized_size(total_size_in_bytes)
+
+
+def get_humanized_size(size_in_bytes):
+    """
+    Returns a tuple containing a size in bytes and its humanized representation.
+    """
+    return (size_in_bytes, humanize.naturalsize(size_in_bytes, gnu=True))
+
+
+def get_remote_folder_sizes(fs, folder_paths) -> dict[str, int]:
+    """
+    Returns the recursive size in bytes of each folder, computed on the remote server
+    with a single `du` call over an exec channel (instead of listing every file over
+    SFTP and adding up the sizes locally). Folders that could not be measured (e.g.,
+    they do not exist) are left out of the result.
+    """
+    # `-b` reports apparent sizes in bytes, which matches the sizes returned by SFTP.
+    # `-l` makes every folder get its own full size: by default `du` only counts an
+    # inode once per call, so nested folders and hard links shared between snapshots
+    # would be left out.
+    du = fs.execute(
+        f"du -sbl -- {" ".join(shlex.quote(path) for path in folder_paths)}",
+        check=False,
+    )
+
+    folder_sizes = {}
+    for line in du.stdout.splitlines():
+        size, _, path = line.partition("\t")
+        if size.isdigit():
+            folder_sizes[path] = int(size)
+
+    return folder_sizes
+
+
+def get_remote_file_stats(fs, folder_paths) -> dict[str, tuple[int, str, str]]:
+    """
+    Returns the (size, mtime, inode) of every regular file under the given folders
+    (recursively), keyed by path, from a single remote `find` call. The mtime is kept
+    as reported by `find` and the inode is prefixed by its device number, so both can
+    be compared as-is between runs.
+    """
+    find_format = r"%s\t%T@\t%D:%i\t%p\0"
+    find = fs.execute(
+        f"find {" ".join(shlex.quote(path) for path in folder_paths)} -type f -printf {shlex.quote(find_format)}",
+        check=False,
+    )
+
+    file_stats = {}
+    for record in find.stdout.split("\0"):
+        if record:
+            size, mtime, inode, path = record.split("\t", 3)
+            file_stats[path] = (int(size), mtime, inode)
+
+    return file_stats
+
+
+def iter_remote_file_sizes(fs, folder_path):
+    """
+    Yields the (relative path, size in bytes) of every file under a folder, sorted by
+    path in byte order. The paths are bytes, so the order is the one `sort` used. The
+    files are listed and sorted on the remote server (`find | sort`), and the output is
+    read in chunks as it arrives, so the whole listing is never held in memory.
+    """
+    from fsspec.asyn import sync
+
+    # `%P` is the path relative to the folder; records end with a NUL, and the size
+    # comes first, so a path can hold any byte (even a tab). The records are sorted on
+    # the path alone (the second field, up to the end of the record), by bytes.
+    find_format = r"%s\t%P\0"
+    command = (
+        f"cd -- {shlex.quote(folder_path)} || exit 2;"
+        f" find . -type f -printf {shlex.quote(find_format)}"
+        " | LC_ALL=C sort -z -t \"$(printf '\\t')\" -k2"
+    )
+
+    check_host(fs)
+
+    # Every call to the host holds a slot of its limiter, but the stream does not in
+    # between, as the delta report reads two streams of the same host side by side
+    with track(getattr(fs, "host", "remote"), "exec:find|sort") as counters:
+        with limited(fs, record_latency=False):
+            process = sync(
+                fs.loop,
+                fs.client.create_process,
+                command,
+                encoding=None,
+                timeout=getattr(fs, "operation_timeout", None),
+            )
+
+        try:
+            buffer = b""
+            while True:
+                with limited(fs, record_latency=False):
+                    chunk = sync(
+                        fs.loop,
+                        process.stdout.read,
+                        REMOTE_STREAM_CHUNK_SIZE,
+                        timeout=getattr(fs, "operation_timeout", None),
+                    )
+                if not chunk:
+                    break
+
+                counters["bytes"] += len(chunk)
+
+                *records, buffer = (buffer + chunk).split(b"\0")
+                for record in records:
+                    size, _, path = record.partition(b"\t")
+                    counters["items"] += 1
+                    yield path, int(size)
+
+            with limited(fs, record_latency=False):
+                completed = sync(
+                    fs.loop,
+                    process.wait,
+                    timeout=getattr(fs, "operation_timeout", None),
+                )
+            if completed.exit_status == 2:
+                raise FileNotFoundError(folder_path)
+        finally:
+            process.close()
+
+
+def get_remote_checksums(fs, file_paths) -> dict[str, str]:
+    """
+    Returns the sha256 checksum of each file, computed on the remote server with a
+    single `sha256sum` call (the files are never transferred). Files that could not
+    be hashed (e.g., they were removed or are unreadable) are left out of the result.
+
+    The command runs on its own exec channel of the SSH connection, rather than
+    through `fs.execute`, which sshfs limits to 2 commands at a time per host, so
+    several batches can be hashed in parallel.
+    """
+    from fsspec.asyn import sync
+
+    # `-z` ends every output line with a NUL instead of escaping unusual file names.
+    # Hashing runs at the lowest CPU priority so it does not slow down the server.
+    command = f"nice -n 19 sha256sum -z -- {" ".join(shlex.quote(path) for path in file_paths)}"
+
+    check_host(fs)
+
+    # The duration of a batch depends on the size of its files, so it does not drive
+    # the limit of the host
+    with limited(fs, record_latency=False), track(
+        getattr(fs, "host", "remote"), "exec:sha256sum"
+    ) as counters:
+        sha256sum = sync(
+            fs.loop,
+            fs.client.run,
+            command,
+            check=False,
+            timeout=getattr(fs, "operation_timeout", None),
+        )
+        counters["items"] += len(file_paths)
+        counters["bytes"] += len(sha256sum.stdout)
+
+    checksums = {}
+    for line in sha256sum.stdout.split("\0"):
+        checksum, separator, path = line.partition("  ")
+        if separator:
+            checksums[path] = checksum
+
+    return checksums
 
 
 def get_non_zero_exit_status_container_processes(container_process_list):
     """
     Returns container processes that have a non-zero exit status code (i.e., they
-    did not exit gracefully).
+    did not exit gracefully). Each process is a record with the "name", "image",
+    "command" and "status" of a container, as returned by `docker ps`.
     """
     result = []
-    regex_pattern = r"(\d+)"
+    regex_pattern = r"Exited \((\d+)\)"
 
     for process in container_process_list:
-        (name, image, command, exit_status) = process.split(",")
-        match = re.search(regex_pattern, exit_status)
+        match = re.search(regex_pattern, process["status"])
         # Check if a match exists with a non-zero exit code
-        if match and int(match.group(0)) != 0:
-            result.append((name, image, command, exit_status))
+        if match and int(match.group(1)) != 0:
+            result.append(
+                (
+                    process["name"],
+                    process["image"],
+                    process["command"],
+                    process["status"],
+                )
+            )
 
     return result
+
+
+def parse_server_list(value) -> list[str]:
+    """
+    Parses a comma-separated list of server names (e.g., the `--servers` option).
+    """
+    return [server for server in value.split(",") if server]
+
+
+def select_servers(config: dict, servers=None) -> dict:
+    """
+    Returns the entries of a `file_structure/*.json` config (keyed by server) of the
+    given servers, in config order, or the whole config if `servers` is None. In a
+    sharded run (`run.py --workers`), each worker only checks some of the servers.
+    """
+    if servers is None:
+        return config
+
+    return {server: config[server] for server in config if server in servers}
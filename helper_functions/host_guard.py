@@ -0,0 +1,303 @@
+import io
+import time
+import threading
+
+from termcolor import colored
+
+# Seconds allowed to establish an SSH connection.
+DEFAULT_CONNECT_TIMEOUT = 30
+
+# Seconds allowed for a single remote operation (a listing, a remote command, ...).
+DEFAULT_OPERATION_TIMEOUT = 600
+
+# Number of consecutive failed checks after which the remaining checks of a host
+# are skipped.
+DEFAULT_FAILURE_THRESHOLD = 3
+
+
+class HostUnavailableError(Exception):
+    """
+    Raised instead of contacting a host whose circuit is open, or once the run budget
+    is exhausted.
+    """
+
+
+def is_host_error(exception) -> bool:
+    """
+    Whether an exception comes from an unreachable, slow or failing host (as opposed
+    to a bug or a config error, e.g., a missing folder, which should still stop the
+    run).
+    """
+    if isinstance(exception, (FileNotFoundError, PermissionError)):
+        return False
+
+    return isinstance(
+        exception, (OSError, TimeoutError, HostUnavailableError)
+    ) or type(exception).__module__.startswith("asyncssh")
+
+
+class HostGuard:
+    """
+    Deadlines and circuit breakers of the hosts contacted by the scripts of a run:
+    a connect timeout, a per-operation timeout, an optional budget for the whole run,
+    and a per-host circuit that opens after `failure_threshold` consecutive failed
+    checks (or a failed connection), so the remaining checks of the host are skipped.
+    """
+
+    def __init__(self):
+        self.connect_timeout = DEFAULT_CONNECT_TIMEOUT
+        self.operation_timeout = DEFAULT_OPERATION_TIMEOUT
+        self.failure_threshold = DEFAULT_FAILURE_THRESHOLD
+        self.run_budget = None
+        self.deadline = None
+        # Number of checks reported as "not checked" since the last reset
+        self.skipped_checks = 0
+
+        self._failures = {}
+        self._open_circuits = {}
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        connect_timeout=None,
+        operation_timeout=None,
+        run_budget=None,
+        failure_threshold=None,
+    ):
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if operation_timeout is not None:
+            self.operation_timeout = operation_timeout
+        if failure_threshold is not None:
+            self.failure_threshold = failure_threshold
+        if run_budget is not None:
+            self.run_budget = run_budget
+            self.deadline = time.monotonic() + run_budget
+
+    def remaining_budget(self):
+        """
+        Returns the number of seconds left in the run budget (None if unlimited).
+        """
+        if self.deadline is None:
+            return None
+
+        return self.deadline - time.monotonic()
+
+    def get_timeout(self, timeout):
+        """
+        Returns `timeout`, shortened to the time left in the run budget.
+        """
+        remaining = self.remaining_budget()
+        if remaining is None:
+            return timeout
+
+        return min(timeout, remaining) if timeout else remaining
+
+    def check(self, host):
+        """
+        Raises `HostUnavailableError` if `host` must not be contacted anymore.
+        """
+        remaining = self.remaining_budget()
+        if remaining is not None and remaining <= 0:
+            raise HostUnavailableError("run budget exhausted")
+
+        with self._lock:
+            reason = self._open_circuits.get(host)
+
+        if reason is not None:
+            raise HostUnavailableError(f"circuit open: {reason}")
+
+    def record_success(self, host):
+        if host is None:
+            return
+
+        with self._lock:
+            self._failures[host] = 0
+
+    def record_failure(self, host, exception, open_circuit=False):
+        """
+        Counts a failed check of `host`, and opens its circuit once there were
+        `failure_threshold` consecutive ones (or right away with `open_circuit`).
+        """
+        # Skipped checks are not failures of their own, and checks without a host
+        # (e.g., of a local filesystem) have no circuit
+        if host is None or isinstance(exception, HostUnavailableError):
+            return
+
+        with self._lock:
+            self._failures[host] = self._failures.get(host, 0) + 1
+
+            if open_circuit or self._failures[host] >= self.failure_threshold:
+                self._open_circuits.setdefault(host, describe_host_error(exception))
+
+    def record_skipped_check(self):
+        with self._lock:
+            self.skipped_checks += 1
+
+    def close_circuit(self, host):
+        """
+        Lets `host` be contacted again (e.g., to retry a long-lived stream).
+        """
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open_circuits.pop(host, None)
+
+    def reset(self):
+        """
+        Closes every circuit and restarts the run budget (e.g., for the next run in
+        watch mode).
+        """
+        with self._lock:
+            self._failures.clear()
+            self._open_circuits.clear()
+            self.skipped_checks = 0
+
+            if self.run_budget is not None:
+                self.deadline = time.monotonic() + self.run_budget
+
+
+_host_guard = HostGuard()
+
+
+def get_host_guard() -> HostGuard:
+    """
+    Returns the process-wide host guard.
+    """
+    return _host_guard
+
+
+def describe_host_error(exception) -> str:
+    if isinstance(exception, TimeoutError):
+        return "timed out"
+
+    return str(exception) or type(exception).__name__
+
+
+def print_not_checked(description, reason):
+    get_host_guard().record_skipped_check()
+    print(f"⏭️ {description}: {colored("not checked", "yellow")} ({reason})\n")
+
+
+def run_host_check(host, description, func, *args, **kwargs):
+    """
+    Runs a check of `host`. When the host is unavailable (its circuit is open or the
+    run budget is exhausted), or the check fails because of the host (timeout,
+    connection error, ...), the check is reported as "not checked" and None is
+    returned instead of stopping the whole run. Failures count towards the host's
+    circuit breaker.
+    """
+    host_guard = get_host_guard()
+
+    try:
+        host_guard.check(host)
+        result = func(*args, **kwargs)
+    except Exception as exception:
+        if not is_host_error(exception):
+            raise
+
+        host_guard.record_failure(host, exception)
+        print_not_checked(description, describe_host_error(exception))
+
+        return None
+
+    host_guard.record_success(host)
+
+    return result
+
+
+def check_host(fs):
+    """
+    Raises `HostUnavailableError` if the host of a (pooled) filesystem should not be
+    contacted, for remote calls that do not go through one of its guarded methods
+    (e.g., a streamed listing or a remote process). Does nothing for filesystems
+    without a host guard.
+    """
+    host_guard = getattr(fs, "host_guard", None)
+    if host_guard is not None:
+        host_guard.check(fs.host)
+
+
+class _GuardedFile:
+    """
+    File object wrapper that bounds every read and write of a remote file by the
+    operation timeout of its filesystem (see `GuardedFileSystem._call`).
+    """
+
+    def __init__(self, file, fs):
+        self._file = file
+        self._fs = fs
+
+    def read(self, *args):
+        return self._fs._call(self._file.read, *args)
+
+    def write(self, *args):
+        return self._fs._call(self._file.write, *args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._file.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class GuardedFileSystem:
+    """
+    Wrapper around a pooled SSH filesystem that refuses to contact an unavailable
+    host and bounds every remote operation by the operation timeout (and the run
+    budget). Every other attribute is delegated to the wrapped filesystem.
+    """
+
+    def __init__(self, fs, host, host_guard):
+        self.fs = fs
+        self.host = host
+        self.host_guard = host_guard
+
+    @property
+    def operation_timeout(self):
+        return self.host_guard.get_timeout(self.host_guard.operation_timeout)
+
+    def _call(self, method, *args, **kwargs):
+        self.host_guard.check(self.host)
+
+        # fsspec runs the coroutine behind every blocking call of an async filesystem
+        # with this timeout, and raises `FSTimeoutError` (a `TimeoutError`) past it.
+        kwargs.setdefault("timeout", self.operation_timeout)
+
+        return method(*args, **kwargs)
+
+    def ls(self, path, *args, **kwargs):
+        return self._call(self.fs.ls, path, *args, **kwargs)
+
+    def info(self, path, **kwargs):
+        return self._call(self.fs.info, path, **kwargs)
+
+    def cat_file(self, path, *args, **kwargs):
+        return self._call(self.fs.cat_file, path, *args, **kwargs)
+
+    def get(self, rpath, lpath, *args, **kwargs):
+        return self._call(self.fs.get, rpath, lpath, *args, **kwargs)
+
+    def execute(self, command, *args, **kwargs):
+        return self._call(self.fs.execute, command, *args, **kwargs)
+
+    def open(self, path, mode="rb", **kwargs):
+        if "b" not in mode:
+            # Like fsspec, but on a guarded binary file
+            text_kwargs = {
+                key: kwargs.pop(key)
+                for key in ("encoding", "errors", "newline")
+                if key in kwargs
+            }
+            return io.TextIOWrapper(
+                self.open(path, mode.replace("t", "") + "b", **kwargs), **text_kwargs
+            )
+
+        self.host_guard.check(self.host)
+
+        return _GuardedFile(self.fs.open(path, mode, **kwargs), self)
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
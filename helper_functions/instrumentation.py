@@ -0,0 +1,286 @@
+import sys
+import json
+import time
+import bisect
+import threading
+import contextlib
+
+from termcolor import colored
+
+# Upper bounds (in seconds) of the latency histogram buckets; the last bucket is open.
+LATENCY_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0)
+LATENCY_BUCKET_LABELS = ("≤1ms", "≤10ms", "≤100ms", "≤1s", "≤10s", ">10s")
+
+# Maximum number of individual calls kept for the JSON trace.
+MAX_TRACE_EVENTS = 100_000
+
+
+class OperationStats:
+    """
+    Aggregated statistics of one operation on one host.
+    """
+
+    __slots__ = ("calls", "errors", "total_time", "max_time", "bytes", "items", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.bytes = 0
+        self.items = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_time": self.total_time,
+            "max_time": self.max_time,
+            "bytes": self.bytes,
+            "items": self.items,
+            "histogram": dict(zip(LATENCY_BUCKET_LABELS, self.histogram)),
+        }
+
+
+class Profiler:
+    """
+    Records per-host and per-operation call counts, latency histograms and bytes
+    transferred, plus a trace of individual calls.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stats = {}
+        self.events = []
+        self.dropped_events = 0
+
+        self._lock = threading.Lock()
+
+    def record(self, host, operation, duration, nbytes=0, items=0, error=None):
+        with self._lock:
+            stats = self.stats.setdefault((host, operation), OperationStats())
+            stats.calls += 1
+            stats.errors += error is not None
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.bytes += nbytes
+            stats.items += items
+            stats.histogram[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+            if len(self.events) < MAX_TRACE_EVENTS:
+                self.events.append(
+                    {
+                        "host": host,
+                        "operation": operation,
+                        "start": time.perf_counter() - self.started_at - duration,
+                        "duration": duration,
+                        "bytes": nbytes,
+                        "items": items,
+                        "error": error,
+                    }
+                )
+            else:
+                self.dropped_events += 1
+
+    def print_summary(self):
+        print("\n#")
+        print("# Profile")
+        print("#\n")
+        print(
+            f"{"host":<30} {"operation":<16} {"calls":>7} {"errors":>6} {"total s":>9} {"mean ms":>9} {"max ms":>9} {"bytes":>12} {"items":>9}  latency histogram"
+        )
+
+        for (host, operation), stats in sorted(
+            self.stats.items(), key=lambda item: item[1].total_time, reverse=True
+        ):
+            histogram = " ".join(
+                f"{label}:{count}"
+                for label, count in zip(LATENCY_BUCKET_LABELS, stats.histogram)
+                if count
+            )
+            print(
+                f"{host:<30} {operation:<16} {stats.calls:>7} {colored(f"{stats.errors:>6}", "red") if stats.errors else f"{stats.errors:>6}"} {stats.total_time:>9.3f} {stats.total_time / stats.calls * 1000:>9.1f} {stats.max_time * 1000:>9.1f} {stats.bytes:>12} {stats.items:>9}  {histogram}"
+            )
+
+        print(f"\nTotal run time: {time.perf_counter() - self.started_at:.3f}s\n")
+
+    def dump_trace(self, path):
+        with self._lock:
+            trace = {
+                "summary": [
+                    {"host": host, "operation": operation, **stats.to_dict()}
+                    for (host, operation), stats in self.stats.items()
+                ],
+                "events": self.events,
+                "dropped_events": self.dropped_events,
+            }
+
+        with open(path, "w") as file:
+            json.dump(trace, file, indent=2)
+
+
+_profiler = None
+
+
+def enable_profiling() -> Profiler:
+    """
+    Starts recording every instrumented operation of this process.
+    """
+    global _profiler
+    _profiler = Profiler()
+
+    return _profiler
+
+
+def get_profiler():
+    """
+    Returns the active profiler, or None when profiling is disabled.
+    """
+    return _profiler
+
+
+@contextlib.contextmanager
+def track(host, operation):
+    """
+    Times the enclosed block as one `operation` on `host`. The yielded dict can be
+    filled with the "bytes" and "items" the operation transferred. Does nothing when
+    profiling is disabled.
+    """
+    counters = {"bytes": 0, "items": 0}
+
+    if _profiler is None:
+        yield counters
+        return
+
+    started_at = time.perf_counter()
+    error = None
+    try:
+        yield counters
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        _profiler.record(
+            host,
+            operation,
+            time.perf_counter() - started_at,
+            counters["bytes"],
+            counters["items"],
+            error,
+        )
+
+
+class _InstrumentedStream:
+    """
+    Stand-in for `sys.stdout` that records the time spent printing.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        with track("local", "print") as counters:
+            counters["bytes"] = len(text)
+            return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def instrument_stdout():
+    """
+    Records the time spent writing to stdout (i.e., printing the report).
+    """
+    if not isinstance(sys.stdout, _InstrumentedStream):
+        sys.stdout = _InstrumentedStream(sys.stdout)
+
+
+class _InstrumentedFile:
+    """
+    File object wrapper that records reads (and the bytes read) of a remote file.
+    """
+
+    def __init__(self, file, host):
+        self._file = file
+        self._host = host
+
+    def read(self, *args):
+        with track(self._host, "read") as counters:
+            data = self._file.read(*args)
+            counters["bytes"] = len(data)
+
+        return data
+
+    def readline(self, *args):
+        with track(self._host, "read") as counters:
+            line = self._file.readline(*args)
+            counters["bytes"] = len(line)
+
+        return line
+
+    def __iter__(self):
+        while line := self.readline():
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._file.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class InstrumentedFileSystem:
+    """
+    Wrapper around a (pooled) filesystem that records every remote operation with the
+    active profiler. Every other attribute is delegated to the wrapped filesystem.
+    """
+
+    def __init__(self, fs, host):
+        self.fs = fs
+        self.host = host
+
+    def ls(self, path, *args, **kwargs):
+        with track(self.host, "ls") as counters:
+            listing = self.fs.ls(path, *args, **kwargs)
+            counters["items"] = len(listing)
+
+        return listing
+
+    def info(self, path, **kwargs):
+        with track(self.host, "info"):
+            return self.fs.info(path, **kwargs)
+
+    def open(self, path, *args, **kwargs):
+        with track(self.host, "open"):
+            file = self.fs.open(path, *args, **kwargs)
+
+        return _InstrumentedFile(file, self.host)
+
+    def get(self, rpath, lpath, *args, **kwargs):
+        with track(self.host, "get") as counters:
+            result = self.fs.get(rpath, lpath, *args, **kwargs)
+            counters["items"] = 1
+
+        return result
+
+    def cat_file(self, path, *args, **kwargs):
+        with track(self.host, "cat_file") as counters:
+            data = self.fs.cat_file(path, *args, **kwargs)
+            counters["bytes"] = len(data)
+
+        return data
+
+    def execute(self, command, *args, **kwargs):
+        # Record the program name only (e.g., "exec:du"), not its arguments
+        with track(self.host, f"exec:{command.split(" ", 1)[0]}") as counters:
+            result = self.fs.execute(command, *args, **kwargs)
+            counters["bytes"] = len(result.stdout or "") + len(result.stderr or "")
+
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
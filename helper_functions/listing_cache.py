@@ -0,0 +1,119 @@
+import time
+import threading
+import collections
+
+from termcolor import colored
+
+# Listings older than this (in seconds) are fetched again, even within the same run.
+DEFAULT_TTL = 600
+
+# Maximum number of directory listings kept in memory at once; the least
+# recently used listing is evicted first.
+DEFAULT_MAX_ENTRIES = 4096
+
+
+class ListingCache:
+    """
+    Per-run cache of directory listings with a TTL and size-bounded LRU eviction.
+    A single cache can be shared between several filesystems; entries are keyed by
+    a namespace (e.g., the server/host name) and the listed path.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def wrap(self, fs, namespace):
+        """
+        Returns a filesystem wrapper whose `ls` calls go through this cache.
+        """
+        return CachedListingFileSystem(fs, self, namespace)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            fetched_at, listing = entry
+            if time.monotonic() - fetched_at > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            # Mark the entry as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return listing
+
+    def put(self, key, listing):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), listing)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, namespace=None):
+        """
+        Drops every cached listing, or only the ones belonging to `namespace`.
+        """
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+                return
+
+            for key in [key for key in self._entries if key[0] == namespace]:
+                del self._entries[key]
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        hit_ratio = (self.hits / total * 100) if total else 0.0
+
+        print("\n#")
+        print("# Directory listing cache")
+        print("#\n")
+        print(
+            f"* {colored("Hits:", "green")} {self.hits}, {colored("Misses:", "red")} {self.misses} ({hit_ratio:.1f}% hit ratio)"
+        )
+        print(f"* Evictions: {self.evictions}, Cached listings: {len(self._entries)}\n")
+
+
+class CachedListingFileSystem:
+    """
+    Thin wrapper around an fsspec filesystem that serves `ls` from a `ListingCache`.
+    Every other attribute is delegated to the wrapped filesystem.
+    """
+
+    def __init__(self, fs, cache, namespace):
+        self.fs = fs
+        self.cache = cache
+        self.namespace = namespace
+
+    def ls(self, path, detail=True, **kwargs):
+        key = (self.namespace, path.rstrip("/") or "/")
+
+        listing = self.cache.get(key)
+        if listing is None:
+            # Always fetch the detailed listing so that both `detail=True` and
+            # `detail=False` calls can be answered by the same cache entry.
+            listing = self.fs.ls(path, detail=True, **kwargs)
+            self.cache.put(key, listing)
+
+        if detail:
+            return listing
+
+        return [entry["name"] for entry in listing]
+
+    def __getattr__(self, name):
+        return getattr(self.fs, name)
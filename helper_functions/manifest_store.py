@@ -0,0 +1,154 @@
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+DEFAULT_MANIFEST_PATH = ".cache/manifests.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    server TEXT NOT NULL,
+    app TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    verified_at REAL NOT NULL,
+    PRIMARY KEY (server, app, snapshot)
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    server TEXT NOT NULL,
+    app TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER,
+    PRIMARY KEY (server, app, snapshot, path, name)
+);
+"""
+
+# Entries that were added or changed in `snapshot`, followed by the ones removed since
+# `previous`. Only folders listed in both snapshots are compared, and the size of a
+# directory entry is ignored since it says nothing about its content.
+_DIFF_QUERY = """
+SELECT new.path, new.name,
+       CASE WHEN old.name IS NULL THEN 'added' ELSE 'changed' END,
+       old.size, new.size
+FROM entries AS new
+LEFT JOIN entries AS old
+    ON old.server = new.server AND old.app = new.app AND old.snapshot = :previous
+    AND old.path = new.path AND old.name = new.name
+WHERE new.server = :server AND new.app = :app AND new.snapshot = :snapshot
+    AND EXISTS (
+        SELECT 1 FROM entries AS other
+        WHERE other.server = :server AND other.app = :app
+            AND other.snapshot = :previous AND other.path = new.path
+    )
+    AND (
+        old.name IS NULL
+        OR old.type IS NOT new.type
+        OR (new.type = 'file' AND old.size IS NOT new.size)
+    )
+UNION ALL
+SELECT old.path, old.name, 'removed', old.size, NULL
+FROM entries AS old
+WHERE old.server = :server AND old.app = :app AND old.snapshot = :previous
+    AND EXISTS (
+        SELECT 1 FROM entries AS other
+        WHERE other.server = :server AND other.app = :app
+            AND other.snapshot = :snapshot AND other.path = old.path
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM entries AS new
+        WHERE new.server = :server AND new.app = :app AND new.snapshot = :snapshot
+            AND new.path = old.path AND new.name = old.name
+    )
+ORDER BY 1, 2
+"""
+
+
+class ManifestStore:
+    """
+    Local SQLite store of verified directory listings (names, types and sizes), keyed
+    by server, app, snapshot folder and (config) path. Backup snapshots never change
+    once written, so a snapshot recorded here does not need to be verified again.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        # The store is shared by the worker threads of the async mode.
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def is_verified(self, server, app, snapshot) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM snapshots WHERE server = ? AND app = ? AND snapshot = ?",
+                (server, app, snapshot),
+            ).fetchone()
+
+        return row is not None
+
+    def record(self, server, app, snapshot, folder_listings):
+        """
+        Records the (path, fsspec listing) pairs of a verified snapshot, replacing any
+        previously recorded manifest of the same snapshot.
+        """
+        rows = [
+            (
+                server,
+                app,
+                snapshot,
+                path,
+                detail["name"].split("/")[-1],
+                detail["type"],
+                detail.get("size"),
+            )
+            for path, folder_listing in folder_listings
+            for detail in folder_listing
+        ]
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM entries WHERE server = ? AND app = ? AND snapshot = ?",
+                (server, app, snapshot),
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)",
+                (server, app, snapshot, time.time()),
+            )
+
+    def get_previous_snapshot(self, server, app, snapshot):
+        """
+        Returns the latest verified snapshot older than `snapshot`, if any. Snapshot
+        folder names carry a sortable timestamp (e.g., data_backup_20240117T054501).
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT snapshot FROM snapshots WHERE server = ? AND app = ? AND snapshot < ? "
+                "ORDER BY snapshot DESC LIMIT 1",
+                (server, app, snapshot),
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def diff(self, server, app, previous, snapshot) -> list[tuple]:
+        """
+        Returns the (path, name, change, previous size, size) entries that were added,
+        changed or removed between two recorded snapshots.
+        """
+        with self._lock:
+            return self._connection.execute(
+                _DIFF_QUERY,
+                {"server": server, "app": app, "previous": previous, "snapshot": snapshot},
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,114 @@
+import io
+import sys
+import contextlib
+import contextvars
+
+# Buffer that the current task/thread writes its output to (None means stdout).
+_output_buffer = contextvars.ContextVar("output_buffer", default=None)
+
+
+class _ContextStdout:
+    """
+    Stand-in for `sys.stdout` that routes writes to the buffer of the current
+    context, if there is one. This lets concurrently running checks keep using
+    plain `print()` while their output is still grouped per server/app.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        buffer = _output_buffer.get()
+        if buffer is None:
+            return self._stream.write(text)
+
+        return buffer.write(text)
+
+    def flush(self):
+        if _output_buffer.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+@contextlib.contextmanager
+def buffered_output():
+    """
+    Captures everything printed in the current context (including threads started
+    through `asyncio.to_thread`, which copy the context) into a string buffer.
+    """
+    if not isinstance(sys.stdout, _ContextStdout):
+        sys.stdout = _ContextStdout(sys.stdout)
+
+    buffer = io.StringIO()
+    token = _output_buffer.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _output_buffer.reset(token)
+
+
+# Sections of the report printed so far in a worker of a sharded run (`run.py
+# --workers`), as [phase, server, summary, verdict, buffer] lists; None outside of
+# one.
+_report_sections = None
+
+
+class _SectionStdout:
+    """
+    Stand-in for `sys.stdout` that writes to the buffer of the latest report section.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        return _report_sections[-1][4].write(text)
+
+    def flush(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def report_section(phase, server=None, summary=False, verdict=False):
+    """
+    Starts a new section of the report: everything printed until the next section
+    belongs to `phase` (e.g., "content") of `server`, or to the phase as a whole
+    (e.g., its header) if `server` is None. A `summary` section sums up the run of a
+    single worker (e.g., its cache statistics), so it is kept for every worker, even
+    if two of them print the same. A `verdict` section tells that a worker found
+    nothing to report in the phase (e.g., no anomaly), so it is only kept if no
+    worker printed a section of a server in the phase. Does nothing unless the report
+    is captured by `captured_report_sections`.
+    """
+    if _report_sections is not None:
+        _report_sections.append([phase, server, summary, verdict, io.StringIO()])
+
+
+@contextlib.contextmanager
+def captured_report_sections():
+    """
+    Captures everything printed by a script into report sections (see
+    `report_section`), and yields the list the captured (phase, server, summary,
+    verdict, text) tuples are added to once the script is done. Output printed before
+    the first section belongs to phase "" as a whole.
+    """
+    global _report_sections
+
+    stdout = sys.stdout
+    sections = []
+
+    _report_sections = [["", None, False, False, io.StringIO()]]
+    sys.stdout = _SectionStdout(stdout)
+    try:
+        yield sections
+    finally:
+        sys.stdout = stdout
+        sections.extend(
+            (phase, server, summary, verdict, buffer.getvalue())
+            for phase, server, summary, verdict, buffer in _report_sections
+        )
+        _report_sections = None
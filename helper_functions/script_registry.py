@@ -0,0 +1,83 @@
+import importlib
+
+# Every script `run.py` can run. Listing them must not import anything: the script
+# modules (and the transport libraries they use, e.g., sshfs/asyncssh) are only
+# imported when a script actually runs.
+#
+# "transports" lists what a script needs to reach the servers:
+# * "sftp": file listings/reads over SFTP
+# * "ssh-exec": remote commands over an exec channel of the SSH connection
+#
+# "interval" is the number of seconds between two runs of a script in watch mode
+# (`run.py --watch`).
+#
+# "configs" lists the `file_structure/*.json` configs (keyed by server) a script
+# checks the servers of. In a sharded run (`run.py --workers`), these servers are
+# split between the workers, and each worker runs the script with `--servers`.
+SCRIPTS = [
+    {
+        "name": "backup_check",
+        "module": "scripts.backups.backup_check",
+        "description": "Backup server checks (latest backup, app folders, content, sizes)",
+        # "ssh-exec" is only needed by --remote-size, --remote-manifest and --delta
+        "transports": ["sftp", "ssh-exec"],
+        "interval": 300,
+        "configs": [
+            "file_structure/app_backup_server_content.json",
+            "file_structure/app_backups.json",
+        ],
+    },
+    {
+        "name": "backup_integrity_check",
+        "module": "scripts.backups.backup_integrity_check",
+        "description": "Backup file checksums, hashed on the backup server and cached locally",
+        "transports": ["ssh-exec"],
+        "interval": 3600,
+        "configs": ["file_structure/app_backups.json"],
+    },
+    {
+        "name": "server_docker_compose_config_check",
+        "module": "scripts.app_servers.server_docker_compose_config_check",
+        "description": "Missing keys in the docker compose services of each app",
+        "transports": ["sftp"],
+        "interval": 120,
+        "configs": ["file_structure/app_servers/app_server_docker_config_keys.json"],
+    },
+    {
+        "name": "server_file_and_folder_check",
+        "module": "scripts.app_servers.server_file_and_folder_check",
+        "description": "Live files/folders of each app compared with the expected ones",
+        "transports": ["sftp"],
+        "interval": 900,
+        "configs": ["file_structure/app_servers/app_server_content.json"],
+    },
+    {
+        "name": "server_process_check",
+        "module": "scripts.app_servers.server_process_check",
+        "description": "Docker containers that exited with a non-zero exit code",
+        "transports": ["ssh-exec"],
+        "interval": 60,
+        "configs": ["file_structure/app_servers/servers.json"],
+    },
+]
+
+
+def get_script(name):
+    """
+    Returns the registry entry of a script, given either its name (e.g.,
+    "server_process_check") or its file path (e.g.,
+    "scripts/app_servers/server_process_check.py"). Returns None if it is unknown.
+    """
+    for script in SCRIPTS:
+        module_path = script["module"].replace(".", "/")
+        if name in (script["name"], module_path, f"{module_path}.py"):
+            return script
+
+    return None
+
+
+def run_script(script, argv=None):
+    """
+    Imports the module of a registry entry and runs its `main`.
+    """
+    importlib.import_module(script["module"]).main(argv)
@@ -0,0 +1,153 @@
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from helper_functions.adaptive_limiter import DEFAULT_MAX_CONCURRENCY
+from helper_functions.helpers import parse_server_list
+from helper_functions.output import captured_report_sections
+from helper_functions.script_registry import run_script
+
+
+def get_script_servers(script) -> list[str]:
+    """
+    Returns the servers of every config a registry script checks (see "configs" in
+    `helper_functions/script_registry.py`), in config order.
+    """
+    servers = {}
+    for config_path in script.get("configs", []):
+        with open(config_path, "r") as file:
+            servers.update(dict.fromkeys(json.load(file)))
+
+    return list(servers)
+
+
+def partition_servers(servers, workers) -> list[list[str]]:
+    """
+    Splits the servers into (at most) `workers` shards, round-robin, so servers that
+    are next to each other in the config (and often similar in size) are checked by
+    different workers.
+    """
+    return [servers[index::workers] for index in range(min(workers, len(servers)))]
+
+
+def run_shard(script, argv, servers, host_guard_settings, limiter_settings):
+    """
+    Runs a registry script for some of its servers in a worker process, with
+    connections of its own, and returns its report as (phase, server, summary,
+    verdict, text) sections (see `helper_functions.output.report_section`).
+    """
+    # Imported here, so the coordinator does not need the transport libraries
+    from helper_functions.adaptive_limiter import get_adaptive_limiters
+    from helper_functions.connections import get_connection_pool
+    from helper_functions.host_guard import get_host_guard
+
+    get_host_guard().configure(**host_guard_settings)
+    get_adaptive_limiters().configure(**limiter_settings)
+
+    try:
+        with captured_report_sections() as sections:
+            run_script(script, [*argv, "--servers", ",".join(servers)])
+    finally:
+        get_connection_pool().close()
+
+    return sections
+
+
+def merge_report_sections(shard_sections, servers) -> str:
+    """
+    Merges the report sections of every shard into a single report: the phases in the
+    order they were printed in, and within each phase, the sections of the phase as a
+    whole (e.g., its header, printed by every shard but only kept once, unless it is
+    the summary of a shard) followed by the sections of each server, in config order.
+    The verdict of a phase (e.g., "no anomaly") is only kept if no shard printed a
+    section of a server in it.
+    """
+    phases = {}
+    for sections in shard_sections:
+        for phase, server, summary, verdict, text in sections:
+            shared_texts, verdict_texts, server_texts = phases.setdefault(
+                phase, ([], [], {})
+            )
+
+            if server is not None:
+                server_texts[server] = server_texts.get(server, "") + text
+            elif verdict:
+                if text not in verdict_texts:
+                    verdict_texts.append(text)
+            elif summary or text not in shared_texts:
+                shared_texts.append(text)
+
+    server_order = {server: index for index, server in enumerate(servers)}
+
+    report = []
+    for shared_texts, verdict_texts, server_texts in phases.values():
+        report.extend(shared_texts)
+        if not server_texts:
+            report.extend(verdict_texts)
+        report.extend(
+            server_texts[server]
+            for server in sorted(
+                server_texts, key=lambda server: server_order.get(server, len(servers))
+            )
+        )
+
+    return "".join(report)
+
+
+def run_sharded(script, argv, workers, host_guard_settings, limiter_settings):
+    """
+    Runs a registry script with its servers split between `workers` worker processes
+    (spawned, not forked, so no connection or event loop is shared with the
+    coordinator), and prints the merged report once every worker is done. YAML
+    parsing, set diffing and SSH crypto of different servers run in parallel instead
+    of competing for the GIL of a single process.
+
+    `host_guard_settings` and `limiter_settings` configure the host guard and the
+    adaptive limiters of every worker, like `run.py` does for a single process. The
+    run budget applies to each worker. The maximum number of calls in flight per host
+    is split between the workers, since they all connect to the hosts the servers
+    share (e.g., the backup server).
+    """
+    # The servers selected by the user (if any) are split between the workers, each
+    # of which gets its shard as `--servers`
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument("--servers", type=parse_server_list, default=None)
+    options, shard_argv = parser.parse_known_args(argv)
+
+    servers = [
+        server
+        for server in get_script_servers(script)
+        if options.servers is None or server in options.servers
+    ]
+    shards = partition_servers(servers, workers)
+
+    # Nothing to split (e.g., a script that is not in the registry)
+    if len(shards) < 2:
+        run_script(script, argv)
+        return
+
+    max_concurrency = limiter_settings.get("max_concurrency") or DEFAULT_MAX_CONCURRENCY
+    limiter_settings = {
+        **limiter_settings,
+        "max_concurrency": max(max_concurrency // len(shards), 1),
+    }
+
+    with ProcessPoolExecutor(
+        max_workers=len(shards),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = [
+            executor.submit(
+                run_shard,
+                script,
+                shard_argv,
+                shard,
+                host_guard_settings,
+                limiter_settings,
+            )
+            for shard in shards
+        ]
+        shard_sections = [future.result() for future in futures]
+
+    print(merge_report_sections(shard_sections, servers), end="")
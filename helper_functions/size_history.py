@@ -0,0 +1,273 @@
+import os
+import fcntl
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from helper_functions.snapshot_catalog import SNAPSHOT_TIMESTAMP_FORMAT
+
+DEFAULT_SIZE_HISTORY_PATH = ".cache/backup_sizes.npz"
+
+# Number of previous snapshots the latest size of a backup folder is compared with.
+DEFAULT_WINDOW = 14
+
+# Minimum number of previous snapshots needed to flag a drop or a spike.
+MIN_HISTORY = 5
+
+# A drop/spike is only flagged when the latest size is at least this many standard
+# deviations away from the mean of the window...
+Z_THRESHOLD = 3.0
+
+# ...and changed by at least this fraction since the previous snapshot.
+DROP_THRESHOLD = 0.1
+SPIKE_THRESHOLD = 0.5
+
+# Floor of the standard deviation, as a fraction of the mean, so slowly and steadily
+# growing folders are not flagged for tiny changes.
+RELATIVE_STD_FLOOR = 0.02
+
+# Number of consecutive snapshots with the exact same size flagged as flat growth.
+FLAT_SNAPSHOTS = 7
+
+
+class SizeHistory:
+    """
+    Local columnar time series of the measured backup folder sizes, one point per
+    (server, app, backup folder, measuring method, snapshot), persisted as NumPy
+    arrays in a single `.npz` file. Sizes measured by listing the files of a folder
+    ("ls") and recursively on the server ("du") are kept in separate series, since
+    they are not comparable.
+    """
+
+    def __init__(self, path=DEFAULT_SIZE_HISTORY_PATH):
+        # NumPy is only imported when the size history is used
+        import numpy as np
+
+        self.path = path
+
+        self._series_keys = []
+        self._series_index = {}
+        self._series = np.empty(0, dtype=np.int32)
+        self._timestamps = np.empty(0, dtype="datetime64[s]")
+        self._sizes = np.empty(0, dtype=np.int64)
+
+        # Points recorded in this run, merged into the arrays by `save`, and the ids
+        # of their series
+        self._pending = []
+        self._recorded_series = None
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def _load(self):
+        """
+        Loads the time series saved in the history file, if there is one.
+        """
+        import numpy as np
+
+        if not Path(self.path).exists():
+            return
+
+        with np.load(self.path) as data:
+            # Series ids of the file, mapped to the ids of this history (series only
+            # known to this history, e.g., recorded but not saved yet, keep theirs)
+            series_ids = np.array(
+                [
+                    self._get_series_id(tuple(str(part) for part in key))
+                    for key in zip(
+                        data["series_servers"],
+                        data["series_apps"],
+                        data["series_folders"],
+                        data["series_methods"],
+                    )
+                ],
+                dtype=np.int32,
+            )
+
+            self._series = series_ids[data["series"]]
+            self._timestamps = data["timestamps"]
+            self._sizes = data["sizes"]
+
+    def _get_series_id(self, key) -> int:
+        if key not in self._series_index:
+            self._series_index[key] = len(self._series_keys)
+            self._series_keys.append(key)
+
+        return self._series_index[key]
+
+    def record(self, server, app, backup_folder, method, timestamp, size):
+        """
+        Records the size of a backup folder in the snapshot with the given
+        (`%Y%m%dT%H%M%S`) timestamp. Recording a snapshot again replaces its size.
+        """
+        timestamp = datetime.strptime(timestamp, SNAPSHOT_TIMESTAMP_FORMAT)
+
+        with self._lock:
+            series_id = self._get_series_id((server, app, backup_folder, method))
+            self._pending.append((series_id, timestamp, size))
+
+    def save(self):
+        """
+        Merges the points recorded in this run into the time series, and writes it.
+        Points saved by other runs in the meantime (e.g., by the other workers of a
+        sharded run) are kept: the file is read again, under a lock, before writing.
+        """
+        import numpy as np
+
+        with self._lock:
+            if not self._pending:
+                return
+
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+            # The lock is released when the lock file is closed
+            with open(f"{self.path}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._load()
+
+                series_ids, timestamps, sizes = zip(*self._pending)
+                self._recorded_series = np.unique(np.array(series_ids, dtype=np.int32))
+                self._pending = []
+
+                series = np.concatenate(
+                    [self._series, np.array(series_ids, dtype=np.int32)]
+                )
+                timestamps = np.concatenate(
+                    [self._timestamps, np.array(timestamps, dtype="datetime64[s]")]
+                )
+                sizes = np.concatenate([self._sizes, np.array(sizes, dtype=np.int64)])
+
+                # Sort by series and time; for a snapshot recorded more than once, the
+                # last recorded point wins.
+                order = np.lexsort((np.arange(len(series)), timestamps, series))
+                series, timestamps, sizes = (
+                    series[order],
+                    timestamps[order],
+                    sizes[order],
+                )
+
+                is_last = np.ones(len(series), dtype=bool)
+                is_last[:-1] = (series[1:] != series[:-1]) | (
+                    timestamps[1:] != timestamps[:-1]
+                )
+                self._series = series[is_last]
+                self._timestamps = timestamps[is_last]
+                self._sizes = sizes[is_last]
+
+                servers, apps, folders, methods = zip(*self._series_keys)
+
+                # Written next to the history first, so an interrupted run never
+                # leaves a truncated file behind
+                temporary_path = f"{self.path}.tmp.npz"
+                np.savez(
+                    temporary_path,
+                    series_servers=np.array(servers, dtype=str),
+                    series_apps=np.array(apps, dtype=str),
+                    series_folders=np.array(folders, dtype=str),
+                    series_methods=np.array(methods, dtype=str),
+                    series=self._series,
+                    timestamps=self._timestamps,
+                    sizes=self._sizes,
+                )
+                os.replace(temporary_path, self.path)
+
+    def detect_anomalies(self, window=DEFAULT_WINDOW) -> list[dict]:
+        """
+        Compares the latest size of every series recorded in this run with its
+        `window` previous sizes, for all series at once, and returns the anomalies:
+
+        * "drop": the size went down by `DROP_THRESHOLD` or more since the previous
+          snapshot, and is `Z_THRESHOLD` standard deviations or more below the mean.
+        * "spike": the size went up by `SPIKE_THRESHOLD` or more since the previous
+          snapshot, and is `Z_THRESHOLD` standard deviations or more above the mean.
+        * "flat": the size did not change at all over the last `FLAT_SNAPSHOTS`
+          snapshots (e.g., the same stale dump is copied over and over).
+
+        Must be called after `save`.
+        """
+        import numpy as np
+
+        recorded_series = self._recorded_series
+        if recorded_series is None:
+            return []
+
+        window = max(window, FLAT_SNAPSHOTS - 1)
+        series_count = len(self._series_keys)
+
+        # Position of each point counted from the latest one of its series (the
+        # arrays are sorted by series and time)
+        series_ends = np.cumsum(np.bincount(self._series, minlength=series_count))
+        positions = series_ends[self._series] - np.arange(len(self._series)) - 1
+        in_window = positions <= window
+
+        # One row per series, the latest size in the last column, NaN-padded
+        matrix = np.full((series_count, window + 1), np.nan)
+        matrix[self._series[in_window], window - positions[in_window]] = self._sizes[
+            in_window
+        ]
+        latest_timestamps = np.full(
+            series_count, np.datetime64("NaT", "s"), dtype="datetime64[s]"
+        )
+        latest_timestamps[self._series[positions == 0]] = self._timestamps[
+            positions == 0
+        ]
+
+        matrix = matrix[recorded_series]
+        latest_timestamps = latest_timestamps[recorded_series]
+
+        latest = matrix[:, -1]
+        previous = matrix[:, -2]
+        history = matrix[:, :-1]
+
+        history_count = np.sum(~np.isnan(history), axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nansum(history, axis=1) / history_count
+            std = np.sqrt(
+                np.nansum((history - mean[:, None]) ** 2, axis=1) / history_count
+            )
+            scale = np.maximum(std, RELATIVE_STD_FLOOR * mean)
+            z_scores = (latest - mean) / scale
+            change = np.where(previous > 0, (latest - previous) / previous, np.nan)
+
+        has_history = history_count >= MIN_HISTORY
+        drops = has_history & (change <= -DROP_THRESHOLD) & (z_scores <= -Z_THRESHOLD)
+        spikes = has_history & (change >= SPIKE_THRESHOLD) & (z_scores >= Z_THRESHOLD)
+
+        flat_window = matrix[:, -FLAT_SNAPSHOTS:]
+        flats = (
+            np.all(~np.isnan(flat_window), axis=1)
+            & (np.nanmax(flat_window, axis=1) == np.nanmin(flat_window, axis=1))
+            & (latest > 0)
+        )
+
+        anomalies = []
+        for row in np.flatnonzero(drops | spikes | flats):
+            server, app, backup_folder, method = self._series_keys[
+                recorded_series[row]
+            ]
+            anomalies.append(
+                {
+                    "server": server,
+                    "app": app,
+                    "backup-folder": backup_folder,
+                    "method": method,
+                    "timestamp": latest_timestamps[row].item(),
+                    "size": int(latest[row]),
+                    "previous-size": (
+                        None if np.isnan(previous[row]) else int(previous[row])
+                    ),
+                    "mean-size": None if np.isnan(mean[row]) else float(mean[row]),
+                    "change": None if np.isnan(change[row]) else float(change[row]),
+                    "flags": [
+                        flag
+                        for flag, flagged in (
+                            ("drop", drops[row]),
+                            ("spike", spikes[row]),
+                            ("flat", flats[row]),
+                        )
+                        if flagged
+                    ],
+                }
+            )
+
+        return anomalies
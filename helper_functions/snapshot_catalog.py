@@ -0,0 +1,121 @@
+import re
+import heapq
+import bisect
+import collections
+from datetime import datetime, timedelta
+
+# An example backup folder name is: data_backup_20240117T054501.
+# Anything else in a server's backup folder (e.g., data_incremental_backup) is ignored.
+SNAPSHOT_FOLDER_PATTERN = re.compile(r"data_backup_(\d{8}T\d{6})$")
+
+SNAPSHOT_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S"
+
+
+class SnapshotCatalog:
+    """
+    Catalog of the timestamped backup snapshot folders of a server. Folder names are
+    parsed once; latest/nth queries use a heap selection (no full sort), while range
+    queries build a sorted index on first use.
+    """
+
+    def __init__(self, folder_names):
+        # (timestamp, folder name) pairs; timestamps sort chronologically as strings.
+        self._snapshots = []
+
+        for folder_name in folder_names:
+            match = SNAPSHOT_FOLDER_PATTERN.search(folder_name.split("/")[-1])
+            if match:
+                self._snapshots.append((match.group(1), folder_name))
+
+        self._sorted_snapshots = None
+
+    @classmethod
+    def from_listing(cls, folder_listing):
+        """
+        Builds a catalog from an fsspec `ls(..., detail=True)` listing.
+        """
+        return cls(
+            detail["name"] for detail in folder_listing if detail["type"] == "directory"
+        )
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def latest(self) -> tuple[str, str]:
+        """
+        Returns the (folder name, timestamp) of the latest snapshot.
+        """
+        return self.nth(0)
+
+    def nth(self, index) -> tuple[str, str]:
+        """
+        Returns the (folder name, timestamp) of the `index`-th latest snapshot, with 0
+        being the latest one.
+        """
+        if index >= len(self._snapshots):
+            raise IndexError(
+                f"Only {len(self._snapshots)} timestamped backup folder(s) available"
+            )
+
+        timestamp, folder_name = heapq.nlargest(index + 1, self._snapshots)[-1]
+
+        return folder_name, timestamp
+
+    def latest_n(self, count) -> list[tuple[str, str]]:
+        """
+        Returns the (folder name, timestamp) of the `count` latest snapshots, latest
+        first. Fewer are returned if the catalog does not hold that many.
+        """
+        return [
+            (folder_name, timestamp)
+            for timestamp, folder_name in heapq.nlargest(count, self._snapshots)
+        ]
+
+    def between(self, start, end) -> list[tuple[str, str]]:
+        """
+        Returns the (folder name, timestamp) of the snapshots taken between the `start`
+        and `end` datetimes (both inclusive), oldest first.
+        """
+        if self._sorted_snapshots is None:
+            self._sorted_snapshots = sorted(self._snapshots)
+
+        lower = bisect.bisect_left(
+            self._sorted_snapshots, (start.strftime(SNAPSHOT_TIMESTAMP_FORMAT),)
+        )
+        # "~" sorts after any folder name, so snapshots taken exactly at `end` are kept.
+        upper = bisect.bisect_right(
+            self._sorted_snapshots, (end.strftime(SNAPSHOT_TIMESTAMP_FORMAT), "~")
+        )
+
+        return [
+            (folder_name, timestamp)
+            for timestamp, folder_name in self._sorted_snapshots[lower:upper]
+        ]
+
+    def retention_gaps(self) -> tuple[list, dict]:
+        """
+        Returns the days without any snapshot between the oldest and the latest one, and
+        the days with more than one snapshot (mapped to their snapshot count).
+        """
+        snapshots_per_day = collections.Counter(
+            timestamp[:8] for timestamp, _ in self._snapshots
+        )
+        if not snapshots_per_day:
+            return [], {}
+
+        first_day = datetime.strptime(min(snapshots_per_day), "%Y%m%d").date()
+        last_day = datetime.strptime(max(snapshots_per_day), "%Y%m%d").date()
+
+        missing_days = [
+            first_day + timedelta(days=offset)
+            for offset in range((last_day - first_day).days + 1)
+            if (first_day + timedelta(days=offset)).strftime("%Y%m%d")
+            not in snapshots_per_day
+        ]
+        duplicate_days = {
+            datetime.strptime(day, "%Y%m%d").date(): count
+            for day, count in sorted(snapshots_per_day.items())
+            if count > 1
+        }
+
+        return missing_days, duplicate_days
@@ -0,0 +1,126 @@
+import math
+import time
+import random
+import sqlite3
+import threading
+from pathlib import Path
+
+from helper_functions.expectation_tree import load_expectation_tree
+from helper_functions.helpers import iter_expected_tree
+
+DEFAULT_SAMPLING_STATE_PATH = ".cache/sampling.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checked_folders (
+    config TEXT NOT NULL,
+    server TEXT NOT NULL,
+    app TEXT NOT NULL,
+    path TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (config, server, app, path)
+);
+"""
+
+
+def get_top_level_paths(root_node) -> set:
+    """
+    Returns the config paths of the folders that are checked on every run: the app
+    folder itself and its direct sub-folders.
+    """
+    return {root_node.path} | {child.path for child in root_node.children}
+
+
+class TreeSampler:
+    """
+    Budgeted sampling of the expected folder trees of a `file_structure/*.json`
+    config: each run only lists up to `budget` folders (i.e., `ls` calls) across all
+    apps, split between the apps in proportion to the size of their tree. The
+    top-level folders of every app are always checked; the rest of the budget goes to
+    the folders that were checked the longest time ago (never checked ones first, ties
+    broken at random), so the whole tree is covered every few runs. When each folder
+    was last checked is kept in a local SQLite file.
+    """
+
+    def __init__(self, config_path, budget, path=DEFAULT_SAMPLING_STATE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.config_path = config_path
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+        expectation_tree = load_expectation_tree(config_path)
+        tree_sizes = {
+            (server, app): sum(1 for _ in iter_expected_tree(root_node))
+            for server in expectation_tree
+            for app, root_node in expectation_tree[server].items()
+        }
+        total_size = max(sum(tree_sizes.values()), 1)
+
+        # Largest remainder method: every app gets the floor of its share, and the
+        # folders left over go to the apps with the largest remainders, so the budgets
+        # add up to `budget` (e.g., a budget of 5 for 3 equal trees is 2 + 2 + 1).
+        shares = {key: budget * tree_size for key, tree_size in tree_sizes.items()}
+        self.budgets = {key: share // total_size for key, share in shares.items()}
+        leftover = budget - sum(self.budgets.values())
+        for key in sorted(
+            shares, key=lambda key: shares[key] % total_size, reverse=True
+        )[:leftover]:
+            self.budgets[key] += 1
+        self._random = random.Random()
+
+    def get_last_checked(self, server, app) -> dict:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, checked_at FROM checked_folders WHERE config = ? AND server = ? AND app = ?",
+                (self.config_path, server, app),
+            ).fetchall()
+
+        return dict(rows)
+
+    def select(self, server, app, root_node) -> set:
+        """
+        Returns the config paths of the folders of an app to check in this run, and
+        prints how much of its tree they cover.
+        """
+        nodes = list(iter_expected_tree(root_node))
+        selected_paths = get_top_level_paths(root_node)
+        last_checked = self.get_last_checked(server, app)
+
+        candidates = [node.path for node in nodes if node.path not in selected_paths]
+        self._random.shuffle(candidates)
+        # Stable sort, so folders checked in the same run stay in random order
+        candidates.sort(key=lambda path: last_checked.get(path, -math.inf))
+
+        budget = self.budgets[(server, app)]
+        sample_size = max(budget - len(selected_paths), 0)
+        selected_paths.update(candidates[:sample_size])
+
+        never_checked = sum(1 for path in candidates if path not in last_checked)
+        if budget >= len(nodes):
+            coverage = "the whole tree fits in the budget"
+        elif sample_size:
+            coverage = f"the whole tree is covered every {math.ceil(len(candidates) / sample_size)} runs"
+        else:
+            coverage = f"its budget ({budget}) does not go past the top-level folders, which are always checked"
+        print(
+            f"* Sampling {len(selected_paths)} of {len(nodes)} folders ({never_checked} never checked; {coverage}).\n"
+        )
+
+        return selected_paths
+
+    def mark_checked(self, server, app, paths):
+        checked_at = time.time()
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO checked_folders VALUES (?, ?, ?, ?, ?)",
+                [(self.config_path, server, app, path, checked_at) for path in paths],
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
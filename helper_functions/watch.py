@@ -0,0 +1,98 @@
+import time
+import importlib
+import traceback
+from datetime import datetime
+
+from termcolor import colored
+
+from helper_functions.connections import get_connection_pool
+from helper_functions.host_guard import get_host_guard, is_host_error
+from helper_functions.script_registry import run_script
+
+# Seconds between checks of scripts that do not set their own "interval".
+DEFAULT_WATCH_INTERVAL = 300
+
+# Seconds between SSH keepalive messages, so idle pooled connections stay open
+# between two runs.
+WATCH_KEEPALIVE_INTERVAL = 30
+
+
+def get_watch_fingerprint(module, argv):
+    """
+    Returns the fingerprint of what a script checks, or None if the script does not
+    define a `watch_fingerprint` function (i.e., it runs on every interval) or its
+    host could not be reached (the run then reports it as not checked).
+    """
+    watch_fingerprint = getattr(module, "watch_fingerprint", None)
+    if watch_fingerprint is None:
+        return None
+
+    try:
+        return watch_fingerprint(argv)
+    except Exception as exception:
+        if not is_host_error(exception):
+            raise
+
+        return None
+
+
+def watch(scripts, argv=None, interval=None):
+    """
+    Runs the given registry scripts forever, each on its own interval (`interval`
+    overrides the intervals of the registry). Connections stay open in the pool
+    between runs.
+
+    Scripts with a `watch_fingerprint(argv)` function are only run again when their
+    fingerprint changes, e.g., when a new snapshot folder shows up on the backup
+    server or a compose file is modified. Fingerprints are cheap to compute (a
+    listing or a `stat` per file), so changes are picked up quickly with little I/O.
+    """
+    get_connection_pool().default_connect_kwargs["keepalive_interval"] = (
+        WATCH_KEEPALIVE_INTERVAL
+    )
+
+    next_runs = {script["name"]: 0.0 for script in scripts}
+    fingerprints = {}
+
+    while True:
+        for script in scripts:
+            name = script["name"]
+            if time.monotonic() < next_runs[name]:
+                continue
+
+            next_runs[name] = time.monotonic() + (
+                interval or script.get("interval", DEFAULT_WATCH_INTERVAL)
+            )
+
+            # Every interval gets the whole run budget (fingerprint included), and
+            # retries the hosts that were skipped in the previous one
+            host_guard = get_host_guard()
+            host_guard.reset()
+
+            try:
+                module = importlib.import_module(script["module"])
+                fingerprint = get_watch_fingerprint(module, argv)
+
+                if fingerprint is not None and fingerprints.get(name) == fingerprint:
+                    continue
+
+                print(
+                    f"\n{colored(f"[{datetime.now().isoformat(timespec="seconds")}]", "blue")} Running {colored(name, "cyan")}"
+                )
+                run_script(script, argv)
+
+                # Checks reported as not checked are run again on the next interval,
+                # even if nothing changed
+                if host_guard.skipped_checks:
+                    fingerprints.pop(name, None)
+                else:
+                    fingerprints[name] = fingerprint
+            except Exception:
+                print(colored(f"{name} failed:", "red"))
+                traceback.print_exc()
+
+                # The failure may come from a dropped connection; reconnect on the
+                # next run instead of reusing it.
+                get_connection_pool().close()
+
+        time.sleep(max(min(next_runs.values()) - time.monotonic(), 0))
@@ -1,34 +1,140 @@
-from glob import glob
-
 import os
-import importlib
 import argparse
 
+from helper_functions.adaptive_limiter import get_adaptive_limiters
+from helper_functions.connections import get_connection_pool
+from helper_functions.host_guard import get_host_guard
+from helper_functions.instrumentation import enable_profiling, instrument_stdout
+from helper_functions.script_registry import SCRIPTS, get_script, run_script
+
 parser = argparse.ArgumentParser(add_help=False)
 
-# Pass the python script you want to run (optional)
+# Pass the name or the path of the script you want to run (optional)
 parser.add_argument("-f", "--file", nargs="?", default=None, type=str)
-args = parser.parse_args()
-
-if args.file:
-    script_name = os.path.splitext(args.file)[0]
-else:
-    # If a user does not specify the specific script to run, enumerate the
-    # existing scripts inside `scripts/` for the user to choose one of them.
-    script_files = [f for f in glob("scripts/**/*.py", recursive=True)]
-
-    print("Available scripts:")
-    for i, script_file in enumerate(script_files):
-        script_name = os.path.splitext(script_file)[0]
-        print(f"{i+1}. {script_name}")
-
-    # Prompt the user to choose a script
-    choice = int(input("Enter the number of the script you want to run: "))
-
-    # Import and run the selected script
-    script_name = os.path.splitext(script_files[choice - 1])[0]
-
-# Transform the file path to a module path
-script_name = script_name.replace("/", ".")
-script_module = importlib.import_module(f"{script_name}")
-script_module.main()
+
+# Run every registered script in this process, sharing one SSH connection per host
+parser.add_argument("--all", action="store_true")
+
+# Record per-host/per-operation call counts, latencies and bytes transferred, and print
+# a summary table at the end of the run
+parser.add_argument("--profile", action="store_true")
+
+# Also dump the profile, including every recorded call, to a JSON file
+parser.add_argument("--profile-json", default=None, type=str)
+
+# Keep running the selected script(s), each on its own interval, with the SSH
+# connections kept open between runs
+parser.add_argument("--watch", action="store_true")
+
+# Seconds between two runs of each script in watch mode (overrides the registry)
+parser.add_argument("--watch-interval", default=None, type=float)
+
+# Seconds allowed to connect to a host, and for a single remote operation
+parser.add_argument("--connect-timeout", default=None, type=float)
+parser.add_argument("--operation-timeout", default=None, type=float)
+
+# Seconds allowed for the whole run (per run in watch mode); the checks left once it
+# is spent are reported as "not checked"
+parser.add_argument("--run-budget", default=None, type=float)
+
+# Number of consecutive failed checks after which the remaining checks of a host
+# are skipped
+parser.add_argument("--failure-threshold", default=None, type=int)
+
+# Smoothed latency (seconds) of the listings of a host under which more of its remote
+# calls may run in parallel, and the maximum number of calls in flight per host
+parser.add_argument("--target-latency", default=None, type=float)
+parser.add_argument("--max-concurrency", default=None, type=int)
+
+# Split the servers of each script between this many worker processes, each with
+# connections of its own, and print their merged report in config order
+parser.add_argument("--workers", default=None, type=int)
+
+
+def main():
+    # Any other argument is forwarded to the selected script (e.g., `--async`).
+    args, script_args = parser.parse_known_args()
+
+    # Scripts are looked up in the registry (`helper_functions/script_registry.py`), so
+    # nothing is imported until a script actually runs.
+    if args.all:
+        scripts = SCRIPTS
+    elif args.file:
+        script = get_script(args.file)
+        if script is None:
+            # Scripts that are not registered can still be run by their path
+            script = {
+                "name": args.file,
+                "module": os.path.splitext(args.file)[0].replace("/", "."),
+            }
+        scripts = [script]
+    else:
+        # If a user does not specify the specific script to run, enumerate the
+        # registered scripts for the user to choose one of them.
+        print("Available scripts:")
+        for i, script in enumerate(SCRIPTS):
+            print(
+                f"{i+1}. {script["name"]}: {script["description"]} ({", ".join(script["transports"])})"
+            )
+
+        # Prompt the user to choose a script
+        choice = int(input("Enter the number of the script you want to run: "))
+
+        scripts = [SCRIPTS[choice - 1]]
+
+    # Workers report their output, not their calls, to the coordinator
+    if args.workers is not None and (args.watch or args.profile or args.profile_json):
+        parser.error("--workers cannot be combined with --watch or --profile")
+
+    host_guard_settings = {
+        "connect_timeout": args.connect_timeout,
+        "operation_timeout": args.operation_timeout,
+        "run_budget": args.run_budget,
+        "failure_threshold": args.failure_threshold,
+    }
+    limiter_settings = {
+        "target_latency": args.target_latency,
+        "max_concurrency": args.max_concurrency,
+    }
+
+    get_host_guard().configure(**host_guard_settings)
+    get_adaptive_limiters().configure(**limiter_settings)
+
+    profiler = None
+    if args.profile or args.profile_json:
+        profiler = enable_profiling()
+        instrument_stdout()
+
+    try:
+        if args.watch:
+            from helper_functions.watch import watch
+
+            watch(scripts, script_args, args.watch_interval)
+        elif args.workers is not None:
+            from helper_functions.sharding import run_sharded
+
+            for script in scripts:
+                run_sharded(
+                    script,
+                    script_args,
+                    args.workers,
+                    host_guard_settings,
+                    limiter_settings,
+                )
+        else:
+            for script in scripts:
+                run_script(script, script_args)
+    finally:
+        get_connection_pool().close()
+
+        if profiler is not None:
+            profiler.print_summary()
+
+            if args.profile_json:
+                profiler.dump_trace(args.profile_json)
+
+
+# Guarded, since the worker processes of some scripts (spawned, not forked) import
+# the main module again.
+if __name__ == "__main__":
+    main()
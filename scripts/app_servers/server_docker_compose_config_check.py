@@ -1,122 +1,343 @@
+import os
 import json
-import shutil
-from pathlib import Path
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-import yaml
-
-from sshfs import SSHFileSystem
 from termcolor import colored
 
+from helper_functions.compose_rules import ComposeRules
+from helper_functions.connections import app_server_filesystem
+from helper_functions.document_cache import (
+    CACHE_MISS,
+    DocumentCache,
+    get_file_version,
+)
+from helper_functions.helpers import parse_server_list, select_servers
+from helper_functions.host_guard import (
+    is_host_error,
+    print_not_checked,
+    run_host_check,
+)
+from helper_functions.instrumentation import track
+from helper_functions.output import report_section
+
+# Maximum number of compose files fetched at the same time per server.
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Below this number of compose files to parse, starting worker processes costs more
+# than it saves.
+PROCESS_POOL_MIN_FILES = 32
+
 
 def merge_dicts(dict1, dict2):
     """
-    Merge two nested dictionaries and update values for duplicate keys.
+    Merge the second nested dictionary into the first one (in place) and update values
+    for duplicate keys. The nested dictionaries of the second one are copied as they
+    are merged, so it is never modified and can be shared between apps.
     """
-    merged_dict = dict1.copy()  # Create a copy of the first dictionary
-
-    stack = [(merged_dict, dict2)]
+    stack = [(dict1, dict2)]
     while stack:
         current_dict, other_dict = stack.pop()
         for key, value in other_dict.items():
-            if key in current_dict:
-                if isinstance(current_dict[key], dict) and isinstance(value, dict):
-                    # Merge nested dictionaries
-                    stack.append((current_dict[key], value))
-                else:
-                    # Update value for duplicate key
-                    current_dict[key] = value
+            if isinstance(value, dict):
+                if not isinstance(current_dict.get(key), dict):
+                    current_dict[key] = {}
+                # Merge nested dictionaries
+                stack.append((current_dict[key], value))
             else:
-                # Add new key-value pair
+                # Add the key-value pair, or update the value of a duplicate key
                 current_dict[key] = value
 
-    return merged_dict
+    return dict1
 
 
-def get_services_with_missing_keys(config_object):
+def parse_compose_file(content):
     """
-    Filter the incoming dictionary by checking for the absence of the
-    specific keys provided.
+    Parses the content of a docker compose file, with the libyaml based loader when
+    PyYAML was built with it.
     """
-    filtered_dict = {}
-    service_keys = ["restart", "labels", "logging"]
+    # The YAML parser is only imported when a file actually needs to be parsed
+    import yaml
 
-    for service_key in service_keys:
-        filtered_dict[service_key] = []
+    return yaml.load(content, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
-    for service in config_object["services"].keys():
-        try:
-            _ = config_object["services"][service].keys()
-        except AttributeError:
-            print(
-                f"⚠️ {colored(f"{service}", "yellow")} is part of the docker compose file but does not have any attached keys to it.\n"
-            )
+
+def parse_compose_files(contents, parse_workers):
+    """
+    Parses a batch of docker compose files; large batches are spread over
+    `parse_workers` processes.
+    """
+    with track("local", "yaml.parse") as counters:
+        counters["items"] = len(contents)
+        counters["bytes"] = sum(len(content) for content in contents)
+
+        if parse_workers > 1 and len(contents) >= PROCESS_POOL_MIN_FILES:
+            # Worker processes are spawned rather than forked, since this process
+            # runs the SSH event loop thread.
+            with ProcessPoolExecutor(
+                max_workers=parse_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                return list(
+                    executor.map(
+                        parse_compose_file,
+                        contents,
+                        chunksize=max(len(contents) // (parse_workers * 4), 1),
+                    )
+                )
+
+        return [parse_compose_file(content) for content in contents]
+
+
+def fetch_compose_file(fs, host, docker_compose_file_path, document_cache):
+    """
+    Returns the version of a remote docker compose file along with either its parsed
+    content, if it is cached for that version, or its raw content. Files are read
+    straight from SFTP (no temporary files).
+    """
+    version = get_file_version(fs.info(docker_compose_file_path))
+
+    config_object = document_cache.get(f"{host}:{docker_compose_file_path}", version)
+    if config_object is not CACHE_MISS:
+        return version, config_object, None
+
+    with fs.open(docker_compose_file_path, "r") as config_file:
+        return version, None, config_file.read()
+
+
+def fetch_compose_configs(
+    app_server_docker_config_keys, document_cache, max_in_flight, parse_workers
+) -> dict:
+    """
+    Returns the parsed content of every configured compose file, keyed by (server,
+    path). Each file is fetched once (even if several apps use it), the servers are
+    polled in parallel, and files are only fetched and parsed again when their mtime
+    or size changed since the last run. Files that need parsing are parsed in a
+    single batch.
+
+    Files that could not be fetched because of their server (e.g., a timeout) are
+    reported as "not checked" and left out of the result.
+    """
+    fetches = {}
+    executors = []
+
+    for server in app_server_docker_config_keys:
+        report_section("connections", server)
+
+        host = app_server_docker_config_keys[server]["host"]
+        fs = run_host_check(
+            host,
+            f"Connection to {server}",
+            app_server_filesystem,
+            app_server_docker_config_keys[server],
+        )
+        if fs is None:
             continue
 
-        # Check if a service does not contain the listed keys above
-        for k in service_keys:
-            if k not in config_object["services"][service].keys():
-                filtered_dict[k].append(service)
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        executors.append(executor)
 
-    return filtered_dict
+        server_apps = app_server_docker_config_keys[server]["applications"]
+        for app in server_apps:
+            for docker_compose_file_path in server_apps[app]["docker-compose-configs"]:
+                if (server, docker_compose_file_path) not in fetches:
+                    fetches[(server, docker_compose_file_path)] = executor.submit(
+                        fetch_compose_file,
+                        fs,
+                        host,
+                        docker_compose_file_path,
+                        document_cache,
+                    )
+
+    config_objects = {}
+    to_parse = []
+    try:
+        for key, fetch in fetches.items():
+            server, docker_compose_file_path = key
+            report_section("fetches", server)
+
+            fetched = run_host_check(
+                app_server_docker_config_keys[server]["host"],
+                f"{docker_compose_file_path} on {server}",
+                fetch.result,
+            )
+            if fetched is None:
+                continue
+
+            version, config_object, content = fetched
 
+            if content is None:
+                config_objects[key] = config_object
+            else:
+                to_parse.append((key, version, content))
+    finally:
+        for executor in executors:
+            executor.shutdown()
+
+    parsed_config_objects = parse_compose_files(
+        [content for _, _, content in to_parse], parse_workers
+    )
+
+    for (key, version, _), config_object in zip(to_parse, parsed_config_objects):
+        server, docker_compose_file_path = key
+        document_cache.put(
+            f"{app_server_docker_config_keys[server]["host"]}:{docker_compose_file_path}",
+            version,
+            config_object,
+        )
+        config_objects[key] = config_object
 
-def server_docker_compose_config_check():
+    return config_objects
+
+
+def print_rule_results(rules, results):
+    for service in results.empty_services:
+        print(
+            f"⚠️ {colored(f"{service}", "yellow")} is part of the docker compose file but does not have any attached keys to it.\n"
+        )
+
+    print(f"{colored("Services with missing keys:", "red")}")
+    for key, services in results.missing_keys.items():
+        print(f"{colored(f"{key}:", "red", attrs=["reverse"])} {services}")
+
+    if rules.forbidden_values:
+        print(f"{colored("Services with forbidden values:", "red")}")
+        for (key, value), services in results.forbidden_values.items():
+            print(
+                f"{colored(f"{key} = {json.dumps(value)}:", "red", attrs=["reverse"])} {services}"
+            )
+
+
+def server_docker_compose_config_check(
+    max_in_flight=DEFAULT_MAX_IN_FLIGHT, parse_workers=None, servers=None
+):
     with open(
         "file_structure/app_servers/app_server_docker_config_keys.json", "r"
     ) as file:
-        app_server_docker_config_keys = json.load(file)
+        app_server_docker_config_keys = select_servers(json.load(file), servers)
 
-    Path("./tmp/").mkdir(exist_ok=True)
+    document_cache = DocumentCache()
+    try:
+        config_objects = fetch_compose_configs(
+            app_server_docker_config_keys,
+            document_cache,
+            max_in_flight,
+            parse_workers or os.cpu_count() or 1,
+        )
+    finally:
+        document_cache.close()
 
     for server in app_server_docker_config_keys:
-        Path(f"./tmp/{server}").mkdir(exist_ok=True)
-
-        fs = SSHFileSystem(
-            app_server_docker_config_keys[server]["host"],
-            username=app_server_docker_config_keys[server]["user"],
-        )
+        report_section("checks", server)
 
         server_apps = app_server_docker_config_keys[server]["applications"]
-        for app in server_apps:
-            Path(f"./tmp/{server}/{app}").mkdir(exist_ok=True)
 
+        for app in server_apps:
             print("\n#")
             print(
                 f"# Checking missing docker compose config keys for {colored(app, "cyan")} in {colored(server, "magenta")}"
             )
             print("#\n")
 
+            missing_files = [
+                docker_compose_file_path
+                for docker_compose_file_path in server_apps[app]["docker-compose-configs"]
+                if (server, docker_compose_file_path) not in config_objects
+            ]
+            if missing_files:
+                print_not_checked(
+                    f"Docker compose configs of {app} in {server}",
+                    f"could not fetch {", ".join(missing_files)}",
+                )
+                continue
+
+            # Later files override earlier ones, like `docker compose -f ... -f ...`
             current_dict = {}
-            for docker_compose_file_path in app_server_docker_config_keys[server][
-                "applications"
-            ][app]["docker-compose-configs"]:
-                fs.get(
-                    rpath=docker_compose_file_path,
-                    lpath=f"./tmp/{server}/{app}/",
+            for docker_compose_file_path in server_apps[app]["docker-compose-configs"]:
+                # An empty compose file parses to None
+                merge_dicts(
+                    current_dict,
+                    config_objects[(server, docker_compose_file_path)] or {},
                 )
 
-                docker_compose_file_name = docker_compose_file_path.split("/")[-1]
+            rules = ComposeRules.from_config(server_apps[app])
+            print_rule_results(rules, rules.evaluate(current_dict))
 
-                with open(
-                    f"./tmp/{server}/{app}/{docker_compose_file_name}", "r"
-                ) as config_file:
-                    config_object = yaml.safe_load(config_file)
-                    current_dict = merge_dicts(current_dict, config_object)
+    return True
 
-            filtered_config_data = get_services_with_missing_keys(current_dict)
-            print(f"{colored("Services with missing keys:", "red")}")
-            for key in filtered_config_data:
-                print(
-                    f"{colored(f"{key}:", "red", attrs=["reverse"])} {filtered_config_data[key]}"
-                )
 
-    shutil.rmtree("./tmp/")
+def get_server_compose_versions(server, server_config) -> list[tuple]:
+    """
+    Returns the (server, path, version) of every configured compose file of a server.
+    """
+    fs = app_server_filesystem(server_config)
+
+    return [
+        (
+            server,
+            docker_compose_file_path,
+            get_file_version(fs.info(docker_compose_file_path)),
+        )
+        for app in server_config["applications"].values()
+        for docker_compose_file_path in app["docker-compose-configs"]
+    ]
+
+
+def watch_fingerprint(argv=None):
+    """
+    Returns the version (mtime, size) of every configured compose file. In watch mode
+    (`run.py --watch`), the check only runs again when one of them changes.
+    """
+    with open(
+        "file_structure/app_servers/app_server_docker_config_keys.json", "r"
+    ) as file:
+        app_server_docker_config_keys = json.load(file)
+
+    # Changed rules need a new run too
+    fingerprint = [json.dumps(app_server_docker_config_keys, sort_keys=True)]
+    for server in app_server_docker_config_keys:
+        try:
+            fingerprint.extend(
+                get_server_compose_versions(server, app_server_docker_config_keys[server])
+            )
+        except Exception as exception:
+            if not is_host_error(exception):
+                raise
+
+            # Its checks are reported as not checked by the run, so they are run
+            # again on the next interval
+            fingerprint.append((server, None, None))
+
+    return tuple(fingerprint)
 
-    return True
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Docker compose config checks")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help="Maximum number of compose files fetched at the same time per server",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=None,
+        help=f"Number of processes parsing compose files when there are at least {PROCESS_POOL_MIN_FILES} of them to parse (default: number of CPUs, 1 disables the process pool)",
+    )
+    parser.add_argument(
+        "--servers",
+        type=parse_server_list,
+        default=None,
+        metavar="SERVER,...",
+        help="Only check these servers (default: every configured server)",
+    )
+    args, _ = parser.parse_known_args(argv)
 
-def main():
-    server_docker_compose_config_check()
+    server_docker_compose_config_check(
+        args.max_in_flight, args.parse_workers, args.servers
+    )
 
 
 if __name__ == "__main__":
@@ -1,20 +1,54 @@
 import json
+import argparse
 
-from sshfs import SSHFileSystem
 from termcolor import colored
 
-from helper_functions.helpers import server_app_folder_content_check
+from helper_functions.connections import app_server_filesystem
+from helper_functions.expectation_tree import load_expectation_tree
+from helper_functions.helpers import (
+    parse_server_list,
+    select_servers,
+    server_app_folder_content_check,
+)
+from helper_functions.host_guard import print_not_checked, run_host_check
+from helper_functions.listing_cache import ListingCache
+from helper_functions.output import report_section
+from helper_functions.tree_sampler import DEFAULT_SAMPLING_STATE_PATH, TreeSampler
 
+# Maximum number of directory listings in flight per app content check.
+DEFAULT_MAX_IN_FLIGHT = 1
 
-def server_file_and_folder_check():
+
+def server_file_and_folder_check(
+    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+    stream_extensions=False,
+    remote_manifest=False,
+    sampler=None,
+    servers=None,
+):
     with open("file_structure/app_servers/app_server_content.json", "r") as file:
-        app_server_content = json.load(file)
+        app_server_content = select_servers(json.load(file), servers)
+
+    expectation_tree = load_expectation_tree(
+        "file_structure/app_servers/app_server_content.json"
+    )
+
+    listing_cache = ListingCache()
 
     for server in app_server_content:
-        fs = SSHFileSystem(
-            app_server_content[server]["host"],
-            username=app_server_content[server]["user"],
+        report_section("content", server)
+
+        host = app_server_content[server]["host"]
+
+        # Checks that fail because of the server (e.g., a timeout) are reported as
+        # "not checked" instead of stopping the run (see `helper_functions.host_guard`).
+        server_fs = run_host_check(
+            host,
+            f"Connection to {server}",
+            app_server_filesystem,
+            app_server_content[server],
         )
+        fs = listing_cache.wrap(server_fs, server) if server_fs is not None else None
 
         server_apps = app_server_content[server]["applications"]
         for app in server_apps:
@@ -24,21 +58,102 @@ def server_file_and_folder_check():
             )
             print("#\n")
 
-            if server_app_folder_content_check(fs, app_server_content, server, app):
+            if fs is None:
+                print_not_checked(
+                    f"File and folder content of {app} in {server}",
+                    "no connection",
+                )
+                continue
+
+            content_check_passed = run_host_check(
+                host,
+                f"File and folder content of {app} in {server}",
+                server_app_folder_content_check,
+                fs,
+                expectation_tree,
+                server,
+                app,
+                max_in_flight=max_in_flight,
+                stream_extensions=stream_extensions,
+                remote_manifest=remote_manifest,
+                sampler=sampler,
+            )
+
+            if content_check_passed:
                 print(
                     f"✅ File and folder content check for {colored(app, "cyan")} in {colored(server, "magenta")} was successful."
                 )
-            else:
+            elif content_check_passed is not None:
                 print(
                     f"❌ File and folder content check for {colored(app, "cyan")} in {colored(server, "magenta")} was unsuccessful."
                 )
                 # return False
 
+    report_section("listing-cache", summary=True)
+    listing_cache.print_stats()
+
     return True
 
 
-def main():
-    server_file_and_folder_check()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="App server file and folder checks")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help="Maximum number of directory listings in flight per app content check",
+    )
+    parser.add_argument(
+        "--stream-extensions",
+        action="store_true",
+        help="Stream folders that are only checked for file extensions instead of listing them",
+    )
+    parser.add_argument(
+        "--remote-manifest",
+        action="store_true",
+        help="Fetch each app folder with a single remote `find` call instead of one listing per folder",
+    )
+    parser.add_argument(
+        "--sample-budget",
+        type=int,
+        default=None,
+        metavar="FOLDERS",
+        help="Only list up to FOLDERS folders per run, rotating through the expected trees across runs",
+    )
+    parser.add_argument(
+        "--sampling-state",
+        default=DEFAULT_SAMPLING_STATE_PATH,
+        metavar="PATH",
+        help=f"File recording when each folder was last checked with --sample-budget (default: {DEFAULT_SAMPLING_STATE_PATH})",
+    )
+    parser.add_argument(
+        "--servers",
+        type=parse_server_list,
+        default=None,
+        metavar="SERVER,...",
+        help="Only check these servers (default: every configured server)",
+    )
+    args, _ = parser.parse_known_args(argv)
+
+    sampler = None
+    if args.sample_budget is not None:
+        sampler = TreeSampler(
+            "file_structure/app_servers/app_server_content.json",
+            args.sample_budget,
+            args.sampling_state,
+        )
+
+    try:
+        server_file_and_folder_check(
+            args.max_in_flight,
+            args.stream_extensions,
+            args.remote_manifest,
+            sampler,
+            args.servers,
+        )
+    finally:
+        if sampler is not None:
+            sampler.close()
 
 
 if __name__ == "__main__":
@@ -1,48 +1,113 @@
 import json
+import time
+import shlex
+import asyncio
+import argparse
+import threading
+import collections
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-from fabric import Connection
 from termcolor import colored
 
-from helper_functions.helpers import get_non_zero_exit_status_container_processes
+from helper_functions.connections import app_server_filesystem, get_connection_pool
+from helper_functions.helpers import (
+    get_non_zero_exit_status_container_processes,
+    parse_server_list,
+    select_servers,
+)
+from helper_functions.host_guard import (
+    describe_host_error,
+    get_host_guard,
+    is_host_error,
+    print_not_checked,
+    run_host_check,
+)
+from helper_functions.output import report_section
 
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
 
-def server_process_check():
+# Every field is rendered with the `json` template function, so each output line is a
+# JSON object, no matter which characters (e.g., commas) the fields contain.
+DOCKER_PS_FORMAT = (
+    f'{{"project":{{{{json (.Label "{COMPOSE_PROJECT_LABEL}")}}}},'
+    '"name":{{json .Names}},"image":{{json .Image}},'
+    '"command":{{json .Command}},"status":{{json .Status}}}'
+)
+
+# Exits of compose containers, one JSON object per line.
+DOCKER_EVENTS_COMMAND = (
+    "docker events --filter type=container --filter event=die"
+    f" --filter label={COMPOSE_PROJECT_LABEL} --format {shlex.quote("{{json .}}")}"
+)
+
+# Seconds before the events of a host are followed again, once its stream ended or
+# failed.
+EVENT_STREAM_RETRY_DELAY = 30
+
+
+def get_exited_containers_per_project(server_config) -> dict[str, list[dict]]:
+    """
+    Returns the exited containers of a host, grouped by their compose project label.
+    A single `docker ps` call is made per host, regardless of the number of apps.
+    """
+    # Commands run over an exec channel of the pooled SSH connection, the same one the
+    # other app server scripts use for SFTP.
+    fs = app_server_filesystem(server_config)
+
+    docker_ps = fs.execute(
+        f'docker ps -a -f "status=exited" --format {shlex.quote(DOCKER_PS_FORMAT)}'
+    )
+
+    containers_per_project = collections.defaultdict(list)
+    for line in docker_ps.stdout.splitlines():
+        if line.strip():
+            container = json.loads(line)
+            containers_per_project[container["project"]].append(container)
+
+    return containers_per_project
+
+
+def server_process_check(selected_servers=None):
     with open("file_structure/app_servers/servers.json", "r") as file:
-        servers = json.load(file)
+        servers = select_servers(json.load(file), selected_servers)
+
+    # Poll every host in parallel
+    with ThreadPoolExecutor(max_workers=max(len(servers), 1)) as executor:
+        exited_containers = {
+            server: executor.submit(get_exited_containers_per_project, servers[server])
+            for server in servers
+        }
 
     for server in servers:
-        c = Connection(
-            host=servers[server]["host"],
-            user=servers[server]["user"],
-            forward_agent=True,
+        report_section("containers", server)
+
+        # Hosts that cannot be reached (or time out) are reported as "not checked"
+        # instead of stopping the run (see `helper_functions.host_guard`).
+        containers_per_project = run_host_check(
+            servers[server]["host"],
+            f"Docker containers of {server}",
+            exited_containers[server].result,
         )
 
         server_apps = servers[server]["applications"]
         for app in server_apps:
-            # Set hide to true to not print the output of .run()
-            docker_ps = c.run(
-                f'docker ps -a -f "label=com.docker.compose.project={app}" -f "status=exited" --format "{{{{.Names}}}},{{{{.Image}}}},{{{{.Command}}}},{{{{.Status}}}}"',
-                hide=True,
-            )
-
-            docker_ps = docker_ps.stdout.strip().split("\n")
-
-            # In case running the above "docker ps" command yields no results (no non-zero
-            # and no zero exit code processes), we will get a non-empty list (i.e., docker_ps = [''])
-            # and will need to filter on '' before proceeding.
-            if docker_ps[0] != "":
-                docker_ps_non_zero = get_non_zero_exit_status_container_processes(
-                    docker_ps
-                )
-            else:
-                docker_ps_non_zero = get_non_zero_exit_status_container_processes([])
-
             print("\n#")
             print(
                 f"# Checking docker container statuses for {colored(app, "cyan")} on {colored(server, "magenta")}"
             )
             print("#\n")
 
+            if containers_per_project is None:
+                print_not_checked(
+                    f"Docker containers of {app} on {server}", "no container list"
+                )
+                continue
+
+            docker_ps_non_zero = get_non_zero_exit_status_container_processes(
+                containers_per_project.get(app, [])
+            )
+
             if len(docker_ps_non_zero) > 0:
                 for ps in docker_ps_non_zero:
                     print(f"{colored("*", "red")} {ps}")
@@ -52,8 +117,182 @@ def server_process_check():
                 )
 
 
-def main():
-    server_process_check()
+def get_exited_container_from_event(event) -> dict:
+    """
+    Returns the container record (see `get_exited_containers_per_project`) of a
+    `docker events` `die` event, with a `docker ps` like status, so the same exit code
+    checks apply.
+    """
+    attributes = event["Actor"]["Attributes"]
+
+    return {
+        "project": attributes.get(COMPOSE_PROJECT_LABEL, ""),
+        "name": attributes.get("name", ""),
+        "image": attributes.get("image", event.get("from", "")),
+        # `die` events do not include the command of the container
+        "command": "",
+        "status": f"Exited ({attributes.get("exitCode", "0")}) at {datetime.fromtimestamp(event["time"]).isoformat(timespec="seconds")}",
+    }
+
+
+async def stream_docker_events(fs, server, apps, cursor):
+    """
+    Follows the exits of the compose containers of a host and prints the non-zero
+    exits of the containers of `apps` as soon as each event is decoded. `cursor`
+    holds the time of the last event received, so a restarted stream replays the
+    events that were missed in between (and only those).
+    """
+    command = DOCKER_EVENTS_COMMAND
+    if cursor["time"] is not None:
+        command += f" --since {cursor["time"]}"
+
+    # A process of its own rather than `fs.execute`, which would hold one of the
+    # few shared exec slots of the connection for as long as the stream runs.
+    async with fs.client.create_process(command) as process:
+        async for line in process.stdout:
+            if not line.strip():
+                continue
+
+            # A line cut short or mixed with other output (e.g., a daemon warning)
+            # must not end the stream of the host
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                print_not_checked(
+                    f"Docker event of {server}", f"undecodable line {line.strip()!r}"
+                )
+                continue
+
+            # `--since` has a one second resolution; skip the events already seen
+            time_nano = event.get("timeNano", event["time"] * 10**9)
+            if time_nano <= cursor["time_nano"]:
+                continue
+            cursor["time"], cursor["time_nano"] = event["time"], time_nano
+
+            container = get_exited_container_from_event(event)
+            if container["project"] not in apps:
+                continue
+
+            for ps in get_non_zero_exit_status_container_processes([container]):
+                print(
+                    f"{colored("*", "red")} {colored(container["project"], "cyan")} on {colored(server, "magenta")}: {ps}",
+                    flush=True,
+                )
+
+
+def follow_server_events(server, server_config, deadline=None):
+    """
+    Follows the container exits of a server over a single long-lived exec channel
+    until `deadline` (forever if None), reconnecting after
+    `EVENT_STREAM_RETRY_DELAY` seconds when the stream ends or the host fails.
+    """
+    host = server_config["host"]
+    apps = set(server_config["applications"])
+    cursor = {"time": None, "time_nano": 0}
+
+    while True:
+        fs = run_host_check(
+            host, f"Connection to {server}", app_server_filesystem, server_config
+        )
+
+        if fs is not None:
+            stream = asyncio.run_coroutine_threadsafe(
+                stream_docker_events(fs, server, apps, cursor), fs.loop
+            )
+
+            try:
+                stream.result(
+                    timeout=None if deadline is None else deadline - time.monotonic()
+                )
+                reason = "the event stream ended"
+            except FutureTimeoutError:
+                stream.cancel()
+                return
+            except Exception as exception:
+                if not is_host_error(exception):
+                    raise
+                reason = describe_host_error(exception)
+
+            print_not_checked(
+                f"Docker events of {server}",
+                f"{reason}; retrying in {EVENT_STREAM_RETRY_DELAY} seconds",
+            )
+            get_connection_pool().discard(host)
+
+        if (
+            deadline is not None
+            and time.monotonic() + EVENT_STREAM_RETRY_DELAY >= deadline
+        ):
+            return
+
+        time.sleep(EVENT_STREAM_RETRY_DELAY)
+        get_host_guard().close_circuit(host)
+
+
+def follow_server_processes(duration=None, selected_servers=None):
+    """
+    Reports the containers that exit with a non-zero exit code as it happens, with one
+    `docker events` stream per host, for `duration` seconds (until interrupted if
+    None). Unlike `server_process_check`, containers that crash and restart between
+    two runs are caught too.
+    """
+    with open("file_structure/app_servers/servers.json", "r") as file:
+        servers = select_servers(json.load(file), selected_servers)
+
+    deadline = None if duration is None else time.monotonic() + duration
+
+    print("\n#")
+    print(
+        f"# Following docker container exits on {", ".join(colored(server, "magenta") for server in servers)}"
+    )
+    print("#\n")
+
+    # Daemon threads, so an interrupted run does not wait for the streams
+    threads = [
+        threading.Thread(
+            target=follow_server_events,
+            args=(server, servers[server], deadline),
+            daemon=True,
+        )
+        for server in servers
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Docker container exit checks")
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Report non-zero container exits as they happen, from a `docker events` stream per host",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Stop following after SECONDS (default: until interrupted)",
+    )
+    parser.add_argument(
+        "--servers",
+        type=parse_server_list,
+        default=None,
+        metavar="SERVER,...",
+        help="Only check these servers (default: every configured server)",
+    )
+    args, _ = parser.parse_known_args(argv)
+
+    if args.follow:
+        follow_server_processes(args.duration, args.servers)
+    else:
+        server_process_check(args.servers)
 
 
 if __name__ == "__main__":
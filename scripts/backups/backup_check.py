@@ -1,16 +1,90 @@
 import json
+import asyncio
+import argparse
 from datetime import datetime, date
 
-from sshfs import SSHFileSystem
 from dotenv import dotenv_values
 from termcolor import colored
 
+from helper_functions.connections import get_connection_pool
+
+from helper_functions.backup_delta import DEFAULT_TOP_MOVERS, get_backup_delta
 from helper_functions.helpers import (
-    get_latest_folder_and_timestamp,
-    get_nth_folder_and_timestamp,
     get_folder_size,
+    get_humanized_size,
+    get_remote_folder_sizes,
+    iter_remote_file_sizes,
+    parse_server_list,
+    select_servers,
     server_app_folder_content_check,
 )
+from helper_functions.expectation_tree import load_expectation_tree
+from helper_functions.host_guard import print_not_checked, run_host_check
+from helper_functions.listing_cache import ListingCache
+from helper_functions.manifest_store import DEFAULT_MANIFEST_PATH, ManifestStore
+from helper_functions.tree_sampler import DEFAULT_SAMPLING_STATE_PATH, TreeSampler
+from helper_functions.output import buffered_output, report_section
+from helper_functions.size_history import DEFAULT_SIZE_HISTORY_PATH, SizeHistory
+from helper_functions.snapshot_catalog import SnapshotCatalog
+
+# Maximum number of servers/apps checked at the same time in async mode.
+DEFAULT_CONCURRENCY = 8
+
+# Maximum number of directory listings in flight per app content check.
+DEFAULT_MAX_IN_FLIGHT = 1
+
+# Maximum number of manifest changes printed per app.
+MANIFEST_DIFF_PRINT_LIMIT = 20
+
+
+def check_backup_size_remote(
+    fs, server_backup_folders, full_backup_locations, server, app, size_history=None
+) -> bool:
+    """
+    Prints the recursive size of each backup folder of an app across the given
+    (latest first) snapshot folders. All sizes are aggregated on the server with a
+    single `du` round trip per app. If given, every measured size is recorded in
+    `size_history`.
+    """
+    app_backup_locations = full_backup_locations[server][app]["backup-folders"]
+
+    full_backup_paths = {
+        (backup_folder, folder_name): f"{folder_name}/data/{app}/{backup_folder}"
+        for backup_folder in app_backup_locations
+        for folder_name, _ in server_backup_folders
+    }
+    folder_sizes = get_remote_folder_sizes(fs, list(full_backup_paths.values()))
+
+    for backup_folder in app_backup_locations:
+        print(f"* Backup sizes for {colored(backup_folder, "cyan")}:")
+
+        for folder_name, folder_timestamp in server_backup_folders:
+            backup_date = (
+                datetime.strptime(folder_timestamp, "%Y%m%dT%H%M%S").date().isoformat()
+            )
+            full_backup_path = full_backup_paths[(backup_folder, folder_name)]
+
+            if full_backup_path in folder_sizes:
+                if size_history is not None:
+                    size_history.record(
+                        server,
+                        app,
+                        backup_folder,
+                        "du",
+                        folder_timestamp,
+                        folder_sizes[full_backup_path],
+                    )
+
+                size = get_folder_size([(full_backup_path, folder_sizes[full_backup_path])])
+                print(
+                    f"  {colored(backup_date, "magenta")} {colored(size, "green", attrs=["reverse"])}"
+                )
+            else:
+                print(f"  {colored(backup_date, "magenta")} {colored("missing", "red")}")
+
+        print()
+
+    return True
 
 
 def server_latest_backup_checks(latest_server_backup_timestamp: str) -> bool:
@@ -46,11 +120,13 @@ def check_backup_size(
     full_backup_locations,
     server,
     app,
+    size_history=None,
 ) -> bool:
     """
     Compare today's backup folder size with the one from yesterday. In all cases almost
     (except when: virtuoso size optimization is performed, delete queries are run removing
     large amounts of data), today's backup must be greater than or equal to that from yesterday.
+    If given, both sizes are recorded in `size_history`.
     """
     app_backup_locations = full_backup_locations[server][app]["backup-folders"]
 
@@ -82,6 +158,20 @@ def check_backup_size(
             .isoformat()
         )
 
+        if size_history is not None:
+            for (_, folder_timestamp), files in (
+                (latest_folder_timestamp, backup_files),
+                (second_latest_folder_timestamp, backup_files_1),
+            ):
+                size_history.record(
+                    server,
+                    app,
+                    backup_folder,
+                    "ls",
+                    folder_timestamp,
+                    get_folder_size(files)[0],
+                )
+
         print(
             f"* Backup size for {colored(full_backup_path_1, "cyan")} on {colored(yesterday_date, "magenta")} is {colored(get_folder_size(backup_files_1), "green", attrs=["reverse"])}"
         )
@@ -93,133 +183,779 @@ def check_backup_size(
     return True
 
 
-def server_backup_checks(fs) -> bool:
+def get_server_snapshot_catalog(fs, server) -> SnapshotCatalog:
     """
-    Runs all backup checks
+    Returns the catalog of the timestamped top-level backup folders of a server.
     """
-    with open("file_structure/app_backup_server_content.json", "r") as file:
-        server_apps = json.load(file)
+    return SnapshotCatalog.from_listing(fs.ls(f"/{server}", detail=True))
+
+
+def get_server_backup_folders(fs, server, count=2):
+    """
+    Returns the (folder name, timestamp) tuples of the `count` latest top-level
+    backup folders of a server, latest first.
+    """
+    return get_server_snapshot_catalog(fs, server).latest_n(count)
 
-    for server in server_apps:
-        server_backups = [
-            (detail["name"], detail["type"])
-            for detail in fs.ls(f"/{server}", detail=True)
-        ]
 
-        latest_server_backup_folder_name, latest_server_backup_timestamp = (
-            get_latest_folder_and_timestamp(server_backups)
+def print_retention_gaps(server, snapshot_catalog):
+    """
+    Reports missing days and days with more than one snapshot across the whole
+    backup history of a server.
+    """
+    print("\n#")
+    print(f"# Checking backup retention of {server}")
+    print("#\n")
+
+    missing_days, duplicate_days = snapshot_catalog.retention_gaps()
+
+    print(f"* {server} has {len(snapshot_catalog)} timestamped backup folder(s).")
+
+    if missing_days:
+        print(
+            f"* {colored("Days without a backup:", "red")} {[day.isoformat() for day in missing_days]}"
         )
+    else:
+        print(f"* {server} has no days without a backup. ✅")
 
-        # Fetch the second latest top-level backup folder and its timestamp.
-        # The index is 2 (instead of 1) since the zeroth entry is occupied by a non-timestamped folder.
-        (
-            second_latest_server_backup_folder_name,
-            second_latest_server_backup_timestamp,
-        ) = get_nth_folder_and_timestamp(server_backups, 2)
+    if duplicate_days:
+        print(
+            f"* {colored("Days with more than one backup:", "yellow")} {[f"{day.isoformat()} ({count})" for day, count in duplicate_days.items()]}"
+        )
 
-        print("\n#")
-        print(f"# Checking if {server} has today's backup")
-        print("#\n")
 
-        if server_latest_backup_checks(latest_server_backup_timestamp):
-            print(f"{server} has a backup folder with today's timestamp. ✅")
-        else:
-            print(f"{server} does not have a backup folder with today's timestamp. ❌")
-            # return False
+def server_top_level_checks(fs, server_apps, server, options) -> str:
+    """
+    Checks whether a server has today's backup and a top-level folder for each app.
+    Returns the name of the latest backup folder.
+    """
+    snapshot_catalog = get_server_snapshot_catalog(fs, server)
+
+    (latest_server_backup_folder_name, latest_server_backup_timestamp) = (
+        snapshot_catalog.latest()
+    )
+
+    print("\n#")
+    print(f"# Checking if {server} has today's backup")
+    print("#\n")
+
+    if server_latest_backup_checks(latest_server_backup_timestamp):
+        print(f"{server} has a backup folder with today's timestamp. ✅")
+    else:
+        print(f"{server} does not have a backup folder with today's timestamp. ❌")
+        # return False
+
+    print("\n#")
+    print(
+        f"# Checking if {server} has a top-level folder for each app ({list(server_apps[server].keys())})"
+    )
+    print("#\n")
+
+    if server_app_folder_check(
+        fs, latest_server_backup_folder_name, server_apps[server]["applications"]
+    ):
+        print(f"{server} has a top-level folder for each application. ✅")
+    else:
+        print(f"{server} does not have a top-level folder for each application. ❌")
+        # return False
+
+    if options.retention:
+        print_retention_gaps(server, snapshot_catalog)
+
+    return latest_server_backup_folder_name
+
+
+def print_manifest_diff(manifest_store, server, app, snapshot):
+    """
+    Prints the changes between the recorded manifest of `snapshot` and the one of
+    the previously verified snapshot of the same app.
+    """
+    previous_snapshot = manifest_store.get_previous_snapshot(server, app, snapshot)
+    if previous_snapshot is None:
+        print(f"* No previous manifest of {colored(app, "cyan")} to compare against.\n")
+        return
+
+    changes = manifest_store.diff(server, app, previous_snapshot, snapshot)
+
+    print(
+        f"* {len(changes)} change(s) in {colored(app, "cyan")} between {colored(previous_snapshot, "magenta")} and {colored(snapshot, "magenta")}.\n"
+    )
+    for path, name, change, previous_size, size in changes[:MANIFEST_DIFF_PRINT_LIMIT]:
+        print(
+            f"  {change:<8} {path}/{name} ({"-" if previous_size is None else previous_size} -> {"-" if size is None else size})"
+        )
 
-        print("\n#")
+    if len(changes) > MANIFEST_DIFF_PRINT_LIMIT:
+        print(f"  ... and {len(changes) - MANIFEST_DIFF_PRINT_LIMIT} more")
+
+    print()
+
+
+def print_size_anomalies(anomalies):
+    """
+    Prints the backup folders whose latest size is an outlier of their size history
+    (see `SizeHistory.detect_anomalies`).
+    """
+    report_section("size-history")
+    print("\n#")
+    print("# Checking backup size history")
+    print("#\n")
+
+    if not anomalies:
+        report_section("size-history", verdict=True)
+        print("No backup folder size is out of line with its history. ✅")
+        return
+
+    for anomaly in anomalies:
+        report_section("size-history", anomaly["server"])
+
+        change = (
+            ""
+            if anomaly["change"] is None
+            else f", {anomaly["change"]:+.1%} since the previous snapshot"
+        )
+        mean_size = (
+            ""
+            if anomaly["mean-size"] is None
+            else f", mean {get_humanized_size(round(anomaly["mean-size"]))[1]}"
+        )
+        print(
+            f"❌ {colored(", ".join(anomaly["flags"]), "red")}: {colored(anomaly["backup-folder"], "cyan")} of {colored(anomaly["app"], "cyan")} on {colored(anomaly["server"], "magenta")} is {get_humanized_size(anomaly["size"])[1]} on {colored(anomaly["timestamp"].date().isoformat(), "magenta")}{change}{mean_size}."
+        )
+
+
+def server_app_content_checks(
+    fs,
+    expectation_tree,
+    server,
+    app,
+    latest_server_backup_folder_name,
+    options,
+    manifest_store=None,
+    sampler=None,
+) -> bool:
+    """
+    Runs the file and folder content check of a single app.
+    """
+    if latest_server_backup_folder_name is None:
+        print_not_checked(
+            f"App folder content of {app} in {server}",
+            "the latest backup folder is unknown",
+        )
+        return False
+
+    print("\n#")
+    print(f"# Checking app folder content for {app} in {server}")
+    print("#\n")
+
+    snapshot = latest_server_backup_folder_name.split("/")[-1]
+
+    # Snapshot folders never change once written, so a snapshot that was already
+    # verified in a previous run does not need to be listed again.
+    if manifest_store is not None and manifest_store.is_verified(server, app, snapshot):
         print(
-            f"# Checking if {server} has a top-level folder for each app ({list(server_apps[server].keys())})"
+            f"⏭️ {colored(snapshot, "magenta")} was already verified for {colored(app, "cyan")} in {colored(server, "magenta")}; skipping.\n"
         )
-        print("#\n")
+        print_manifest_diff(manifest_store, server, app, snapshot)
+        return True
+
+    folder_listings = []
+    fully_listed = True
+
+    def record_listing(node_path, folder_listing):
+        nonlocal fully_listed
 
-        if server_app_folder_check(
-            fs, latest_server_backup_folder_name, server_apps[server]["applications"]
-        ):
-            print(f"{server} has a top-level folder for each application. ✅")
+        if folder_listing is None:
+            fully_listed = False
         else:
-            print(f"{server} does not have a top-level folder for each application. ❌")
-            # return False
+            folder_listings.append((node_path, folder_listing))
+
+    content_check_passed = server_app_folder_content_check(
+        fs,
+        expectation_tree,
+        server,
+        app,
+        latest_server_backup_folder_name,
+        options.max_in_flight,
+        listing_callback=record_listing if manifest_store is not None else None,
+        stream_extensions=options.stream_extensions,
+        remote_manifest=options.remote_manifest,
+        sampler=sampler,
+    )
 
-        for app in server_apps[server]["applications"]:
-            print("\n#")
-            print(f"# Checking app folder content for {app} in {server}")
-            print("#\n")
+    if manifest_store is not None:
+        # Only a snapshot that passed with every folder listed is skipped next time;
+        # a failed one (e.g., checked while it was still being written) is checked
+        # again on the next run.
+        if content_check_passed and fully_listed:
+            manifest_store.record(server, app, snapshot, folder_listings)
+            print_manifest_diff(manifest_store, server, app, snapshot)
+        else:
+            print(
+                f"* {colored(snapshot, "magenta")} was not recorded in the manifest store; it is checked again next run.\n"
+            )
 
-            if server_app_folder_content_check(
-                fs, server_apps, server, app, latest_server_backup_folder_name
-            ):
-                print(
-                    f"✅ File and folder content check for {colored(app, "cyan")} in {colored(server, "magenta")} was successful."
-                )
-            else:
-                print(
-                    f"❌ File and folder content check for {colored(app, "cyan")} in {colored(server, "magenta")} was unsuccessful."
-                )
-                # return False
+    if content_check_passed:
+        print(
+            f"✅ File and folder content check for {colored(app, "cyan")} in {colored(server, "magenta")} was successful."
+        )
+        return True
+
+    print(
+        f"❌ File and folder content check for {colored(app, "cyan")} in {colored(server, "magenta")} was unsuccessful."
+    )
+    return False
+
+
+def server_app_backup_size_checks(
+    fs,
+    full_backup_locations,
+    server,
+    app,
+    server_backup_folders,
+    options,
+    size_history=None,
+) -> bool:
+    """
+    Runs the backup size check of a single app.
+    """
+    if server_backup_folders is None:
+        print_not_checked(
+            f"Backups of {app} on {server}", "the backup folders are unknown"
+        )
+        return False
+
+    print("\n#")
+    print(f"# Checking Backups for {app} on {server}")
+    print("#\n")
+
+    if options.remote_size_days is not None:
+        check_passed = check_backup_size_remote(
+            fs,
+            server_backup_folders,
+            full_backup_locations,
+            server,
+            app,
+            size_history,
+        )
+    elif len(server_backup_folders) < 2:
+        print(f"{server} has less than two backup folders to compare. ❌")
+        check_passed = False
+    else:
+        latest_server_backup_folder, second_latest_server_backup_folder = (
+            server_backup_folders[:2]
+        )
+
+        check_passed = check_backup_size(
+            fs,
+            latest_server_backup_folder,
+            second_latest_server_backup_folder,
+            full_backup_locations,
+            server,
+            app,
+            size_history,
+        )
+
+    if options.delta is not None:
+        print_backup_delta(
+            fs, server_backup_folders, full_backup_locations, server, app, options.delta
+        )
+
+    return check_passed
+
+
+def print_backup_delta(
+    fs, server_backup_folders, full_backup_locations, server, app, top_movers
+):
+    """
+    Prints which files of each backup folder of an app were added, removed, grown or
+    shrunk since the previous snapshot, with the files that changed the most. Both
+    snapshots are listed and sorted on the server and merge-joined as they stream in.
+    """
+    if len(server_backup_folders) < 2:
+        print(f"{server} has less than two backup folders to compare. ❌")
+        return
+
+    latest_folder, _ = server_backup_folders[0]
+    previous_folder, previous_timestamp = server_backup_folders[1]
+    previous_date = (
+        datetime.strptime(previous_timestamp, "%Y%m%dT%H%M%S").date().isoformat()
+    )
+
+    for backup_folder in full_backup_locations[server][app]["backup-folders"]:
+        try:
+            changes, movers = get_backup_delta(
+                iter_remote_file_sizes(
+                    fs, f"{previous_folder}/data/{app}/{backup_folder}"
+                ),
+                iter_remote_file_sizes(
+                    fs, f"{latest_folder}/data/{app}/{backup_folder}"
+                ),
+                top_movers,
+            )
+        except FileNotFoundError as exception:
+            print(
+                f"* Delta for {colored(backup_folder, "cyan")}: {colored(f"{exception} is missing", "red")}\n"
+            )
+            continue
+
+        summary = ", ".join(
+            f"{file_count} {kind} ({"+" if byte_delta >= 0 else "-"}{get_humanized_size(abs(byte_delta))[1]})"
+            for kind, (file_count, byte_delta) in changes.items()
+        )
+        print(
+            f"* Delta for {colored(backup_folder, "cyan")} since {colored(previous_date, "magenta")}: {summary}"
+        )
+
+        for path, previous_size, size in movers:
+            delta = (size or 0) - (previous_size or 0)
+            delta_text = f"{"+" if delta >= 0 else "-"}{get_humanized_size(abs(delta))[1]}"
+            print(
+                f"  {colored(f"{delta_text:>8}", "green" if delta >= 0 else "red")} {path.decode(errors="replace")} ({"-" if previous_size is None else get_humanized_size(previous_size)[1]} -> {"-" if size is None else get_humanized_size(size)[1]})"
+            )
+
+        print()
+
+
+def server_backup_checks(
+    fs, options=None, manifest_store=None, sampler=None, size_history=None
+) -> bool:
+    """
+    Runs all backup checks
+    """
+    options = options or parse_options([])
+
+    with open("file_structure/app_backup_server_content.json", "r") as file:
+        server_apps = select_servers(json.load(file), options.servers)
+
+    expectation_tree = load_expectation_tree(
+        "file_structure/app_backup_server_content.json"
+    )
+
+    # Checks that fail because of the backup server (e.g., a timeout) are reported as
+    # "not checked" instead of stopping the run (see `helper_functions.host_guard`).
+    host = getattr(fs, "host", None)
+
+    for server in server_apps:
+        report_section("content", server)
+
+        latest_server_backup_folder_name = run_host_check(
+            host,
+            f"Top-level checks of {server}",
+            server_top_level_checks,
+            fs,
+            server_apps,
+            server,
+            options,
+        )
+
+        for app in server_apps[server]["applications"]:
+            run_host_check(
+                host,
+                f"App folder content of {app} in {server}",
+                server_app_content_checks,
+                fs,
+                expectation_tree,
+                server,
+                app,
+                latest_server_backup_folder_name,
+                options,
+                manifest_store,
+                sampler,
+            )
 
     # Check and compare backup folder sizes
     with open("file_structure/app_backups.json", "r") as file:
-        full_backup_locations = json.load(file)
+        full_backup_locations = select_servers(json.load(file), options.servers)
 
+    report_section("sizes")
     print("\n#")
     print("# Checking Backups")
     print("#\n")
 
     for server in full_backup_locations:
-        # NOTE: Duplicate snippet from the for-loop above. However, we cannot know whether
-        # a user specifies the same servers and apps to have their backups checked, so it is
-        # safer to fetch the latest folders and timestamps again.
-        server_backups = [
-            (detail["name"], detail["type"])
-            for detail in fs.ls(f"/{server}", detail=True)
-        ]
-
-        latest_server_backup_folder_name, latest_server_backup_timestamp = (
-            get_latest_folder_and_timestamp(server_backups)
+        report_section("sizes", server)
+
+        # NOTE: We cannot know whether a user specifies the same servers and apps to have
+        # their backups checked, so it is safer to fetch the latest folders and timestamps
+        # again. The listing itself is served from the run's listing cache when the server
+        # was already seen above.
+        server_backup_folders = run_host_check(
+            host,
+            f"Backup folders of {server}",
+            get_server_backup_folders,
+            fs,
+            server,
+            options.remote_size_days or 2,
         )
 
-        # Fetch the second latest top-level backup folder and its timestamp.
-        # The index is 2 (instead of 1) since the zeroth entry is occupied by a non-timestamped folder.
-        (
-            second_latest_server_backup_folder_name,
-            second_latest_server_backup_timestamp,
-        ) = get_nth_folder_and_timestamp(server_backups, 2)
-
         for app in full_backup_locations[server]:
-            print("\n#")
-            print(f"# Checking Backups for {app} on {server}")
-            print("#\n")
-
-            check_backup_size(
+            run_host_check(
+                host,
+                f"Backups of {app} on {server}",
+                server_app_backup_size_checks,
                 fs,
-                (
-                    latest_server_backup_folder_name,
-                    latest_server_backup_timestamp,
-                ),
-                (
-                    second_latest_server_backup_folder_name,
-                    second_latest_server_backup_timestamp,
-                ),
                 full_backup_locations,
                 server,
                 app,
+                server_backup_folders,
+                options,
+                size_history,
+            )
+
+    return True
+
+
+async def _run_buffered(semaphore, func, *args):
+    """
+    Runs a blocking check in a worker thread (at most `semaphore` of them at once)
+    and returns its result together with everything it printed.
+    """
+    async with semaphore:
+        with buffered_output() as output:
+            result = await asyncio.to_thread(func, *args)
+
+    return result, output.getvalue()
+
+
+async def _server_content_checks_async(
+    fs,
+    server_apps,
+    expectation_tree,
+    server,
+    semaphore,
+    options,
+    manifest_store,
+    sampler,
+):
+    host = getattr(fs, "host", None)
+
+    latest_server_backup_folder_name, output = await _run_buffered(
+        semaphore,
+        run_host_check,
+        host,
+        f"Top-level checks of {server}",
+        server_top_level_checks,
+        fs,
+        server_apps,
+        server,
+        options,
+    )
+
+    app_checks = [
+        _run_buffered(
+            semaphore,
+            run_host_check,
+            host,
+            f"App folder content of {app} in {server}",
+            server_app_content_checks,
+            fs,
+            expectation_tree,
+            server,
+            app,
+            latest_server_backup_folder_name,
+            options,
+            manifest_store,
+            sampler,
+        )
+        for app in server_apps[server]["applications"]
+    ]
+
+    return output + "".join(
+        app_output for _, app_output in await asyncio.gather(*app_checks)
+    )
+
+
+async def _server_size_checks_async(
+    fs, full_backup_locations, server, semaphore, options, size_history
+):
+    host = getattr(fs, "host", None)
+
+    server_backup_folders, output = await _run_buffered(
+        semaphore,
+        run_host_check,
+        host,
+        f"Backup folders of {server}",
+        get_server_backup_folders,
+        fs,
+        server,
+        options.remote_size_days or 2,
+    )
+
+    app_checks = [
+        _run_buffered(
+            semaphore,
+            run_host_check,
+            host,
+            f"Backups of {app} on {server}",
+            server_app_backup_size_checks,
+            fs,
+            full_backup_locations,
+            server,
+            app,
+            server_backup_folders,
+            options,
+            size_history,
+        )
+        for app in full_backup_locations[server]
+    ]
+
+    return output + "".join(
+        app_output for _, app_output in await asyncio.gather(*app_checks)
+    )
+
+
+async def server_backup_checks_async(
+    fs, options=None, manifest_store=None, sampler=None, size_history=None
+) -> bool:
+    """
+    Runs all backup checks with servers and apps checked concurrently. The output of
+    every server is buffered and printed in config order, so it reads the same as
+    the output of `server_backup_checks`.
+    """
+    options = options or parse_options([])
+
+    with open("file_structure/app_backup_server_content.json", "r") as file:
+        server_apps = select_servers(json.load(file), options.servers)
+
+    with open("file_structure/app_backups.json", "r") as file:
+        full_backup_locations = select_servers(json.load(file), options.servers)
+
+    expectation_tree = load_expectation_tree(
+        "file_structure/app_backup_server_content.json"
+    )
+
+    semaphore = asyncio.Semaphore(options.concurrency)
+
+    content_checks = [
+        asyncio.create_task(
+            _server_content_checks_async(
+                fs,
+                server_apps,
+                expectation_tree,
+                server,
+                semaphore,
+                options,
+                manifest_store,
+                sampler,
+            )
+        )
+        for server in server_apps
+    ]
+    size_checks = [
+        asyncio.create_task(
+            _server_size_checks_async(
+                fs, full_backup_locations, server, semaphore, options, size_history
             )
+        )
+        for server in full_backup_locations
+    ]
 
+    # Print each server's output as soon as it and every server before it are done.
+    for server, content_check in zip(server_apps, content_checks):
+        report_section("content", server)
+        print(await content_check, end="")
 
-def backup_server_checks() -> None:
+    report_section("sizes")
+    print("\n#")
+    print("# Checking Backups")
+    print("#\n")
+
+    for server, size_check in zip(full_backup_locations, size_checks):
+        report_section("sizes", server)
+        print(await size_check, end="")
+
+    return True
+
+
+def backup_server_filesystem():
+    """
+    Returns the pooled filesystem of the backup server, and its address.
+    """
     config = dotenv_values(".env/.env.sftp")
 
     # Connect with a password
-    fs = SSHFileSystem(
-        config["address"], username=config["username"], password=config["password"]
+    fs = get_connection_pool().filesystem(
+        config["address"], config["username"], password=config["password"]
     )
 
-    server_backup_checks(fs)
+    return fs, config["address"]
+
+
+def backup_server_checks(options) -> None:
+    connection = run_host_check(None, "Backup server", backup_server_filesystem)
+    if connection is None:
+        return
+
+    fs, address = connection
+
+    # Every directory is listed at most once per run; repeated listings are served
+    # from the cache.
+    listing_cache = ListingCache()
+    cached_fs = listing_cache.wrap(fs, address)
+
+    manifest_store = ManifestStore(options.manifest) if options.manifest else None
+
+    sampler = None
+    if options.sample_budget is not None:
+        sampler = TreeSampler(
+            "file_structure/app_backup_server_content.json",
+            options.sample_budget,
+            options.sampling_state,
+        )
+
+    size_history = None
+    if options.size_history:
+        size_history = SizeHistory(options.size_history)
+
+    try:
+        if options.use_async:
+            asyncio.run(
+                server_backup_checks_async(
+                    cached_fs, options, manifest_store, sampler, size_history
+                )
+            )
+        else:
+            server_backup_checks(
+                cached_fs, options, manifest_store, sampler, size_history
+            )
+
+        if size_history is not None:
+            size_history.save()
+            print_size_anomalies(size_history.detect_anomalies())
+    finally:
+        if manifest_store is not None:
+            manifest_store.close()
+        if sampler is not None:
+            sampler.close()
+
+    report_section("listing-cache", summary=True)
+    listing_cache.print_stats()
+
+
+def watch_fingerprint(argv=None):
+    """
+    Returns the latest backup folder of every configured server. In watch mode
+    (`run.py --watch`), the checks only run again when a new snapshot folder shows up,
+    at the cost of a single listing per server.
+    """
+    fs, _ = backup_server_filesystem()
+
+    servers = set()
+    for config_path in (
+        "file_structure/app_backup_server_content.json",
+        "file_structure/app_backups.json",
+    ):
+        with open(config_path, "r") as file:
+            servers.update(json.load(file))
+
+    return tuple(
+        (server, get_server_snapshot_catalog(fs, server).latest_n(1))
+        for server in sorted(servers)
+    )
+
+
+def parse_options(argv=None):
+    parser = argparse.ArgumentParser(description="Backup server checks")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Check servers and apps concurrently",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximum number of servers/apps checked at the same time with --async",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help="Maximum number of directory listings in flight per app content check",
+    )
+    parser.add_argument(
+        "--remote-size",
+        dest="remote_size_days",
+        type=int,
+        nargs="?",
+        const=2,
+        default=None,
+        metavar="DAYS",
+        help="Aggregate backup folder sizes on the server with `du` over the last DAYS snapshots (default: 2)",
+    )
+    parser.add_argument(
+        "--manifest",
+        nargs="?",
+        const=DEFAULT_MANIFEST_PATH,
+        default=None,
+        metavar="PATH",
+        help=f"Record verified listings in a SQLite manifest store and skip already verified snapshots (default: {DEFAULT_MANIFEST_PATH})",
+    )
+    parser.add_argument(
+        "--stream-extensions",
+        action="store_true",
+        help="Stream folders that are only checked for file extensions instead of listing them",
+    )
+    parser.add_argument(
+        "--remote-manifest",
+        action="store_true",
+        help="Fetch each app folder with a single remote `find` call instead of one listing per folder",
+    )
+    parser.add_argument(
+        "--retention",
+        action="store_true",
+        help="Report days without a backup and days with more than one backup",
+    )
+    parser.add_argument(
+        "--sample-budget",
+        type=int,
+        default=None,
+        metavar="FOLDERS",
+        help="Only list up to FOLDERS folders of the latest snapshot per run, rotating through the expected trees across runs",
+    )
+    parser.add_argument(
+        "--sampling-state",
+        default=DEFAULT_SAMPLING_STATE_PATH,
+        metavar="PATH",
+        help=f"File recording when each folder was last checked with --sample-budget (default: {DEFAULT_SAMPLING_STATE_PATH})",
+    )
+    parser.add_argument(
+        "--delta",
+        type=int,
+        nargs="?",
+        const=DEFAULT_TOP_MOVERS,
+        default=None,
+        metavar="TOP",
+        help=f"Report the files added, removed, grown and shrunk since the previous snapshot, with the TOP largest changes (default: {DEFAULT_TOP_MOVERS})",
+    )
+    parser.add_argument(
+        "--size-history",
+        nargs="?",
+        const=DEFAULT_SIZE_HISTORY_PATH,
+        default=None,
+        metavar="PATH",
+        help=f"Record every measured backup folder size in a local time series and report sizes out of line with their history (default: {DEFAULT_SIZE_HISTORY_PATH})",
+    )
+    parser.add_argument(
+        "--servers",
+        type=parse_server_list,
+        default=None,
+        metavar="SERVER,...",
+        help="Only check these servers (default: every configured server)",
+    )
+    options, _ = parser.parse_known_args(argv)
+
+    # A sampled snapshot is never fully verified, so it cannot be skipped next time
+    if options.sample_budget is not None and options.manifest:
+        parser.error("--sample-budget cannot be combined with --manifest")
+
+    return options
 
 
-def main():
-    backup_server_checks()
+def main(argv=None):
+    backup_server_checks(parse_options(argv))
 
 
 if __name__ == "__main__":
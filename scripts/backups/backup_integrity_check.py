@@ -0,0 +1,318 @@
+import re
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import colored
+
+from helper_functions.checksum_cache import DEFAULT_CHECKSUM_CACHE_PATH, ChecksumCache
+from helper_functions.host_guard import run_host_check
+from helper_functions.helpers import (
+    get_humanized_size,
+    get_remote_checksums,
+    get_remote_file_stats,
+    parse_server_list,
+    select_servers,
+)
+from helper_functions.output import report_section
+from scripts.backups.backup_check import (
+    backup_server_filesystem,
+    get_server_backup_folders,
+)
+
+# Number of files hashed by a single remote `sha256sum` call.
+DEFAULT_BATCH_SIZE = 32
+
+# Number of `sha256sum` calls running at the same time on the backup server.
+DEFAULT_PARALLEL = 4
+
+# Maximum number of suspicious files printed per backup folder.
+SUSPICIOUS_FILES_PRINT_LIMIT = 20
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value) -> int:
+    """
+    Parses a size in bytes with an optional binary unit (e.g., "500G").
+    """
+    match = re.fullmatch(
+        r"(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?", value.strip(), re.IGNORECASE
+    )
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+class ByteBudget:
+    """
+    Number of bytes that may still be hashed in this run (unlimited if None).
+    """
+
+    def __init__(self, limit=None):
+        self.remaining = limit
+
+    def take(self, size) -> bool:
+        """
+        Takes `size` bytes from the budget. The last file taken may overshoot the
+        budget, so that files larger than the whole budget are eventually hashed too.
+        """
+        if self.remaining is None:
+            return True
+
+        if self.remaining <= 0:
+            return False
+
+        self.remaining -= size
+        return True
+
+
+def verify_checksums(fs, host, checksum_cache, file_stats, budget, options):
+    """
+    Returns the checksums of the given files (cached ones are reused, the others are
+    hashed on the server in parallel batches, within the byte budget), along with the
+    number of files hashed in this run, the files left for a later run and the files
+    that could not be hashed. Paths hard-linked to the same inode are hashed (and
+    taken from the budget) once.
+    """
+    checksums = {}
+    to_hash = []
+    pending = []
+
+    # Paths of every inode to hash, the first one being the one that is hashed
+    linked_paths = {}
+
+    for path, (size, mtime, inode) in file_stats.items():
+        checksum = checksum_cache.get(host, path, size, mtime, inode)
+
+        if checksum is not None:
+            checksums[path] = checksum
+        elif inode in linked_paths:
+            linked_paths[inode].append(path)
+        elif budget.take(size):
+            to_hash.append(path)
+            linked_paths[inode] = [path]
+        else:
+            pending.append(path)
+
+    batches = [
+        to_hash[i : i + options.batch_size]
+        for i in range(0, len(to_hash), options.batch_size)
+    ]
+
+    with ThreadPoolExecutor(max_workers=options.parallel) as executor:
+        for batch_checksums in executor.map(
+            lambda batch: get_remote_checksums(fs, batch), batches
+        ):
+            linked_checksums = {
+                linked_path: checksum
+                for path, checksum in batch_checksums.items()
+                for linked_path in linked_paths[file_stats[path][2]]
+            }
+            checksums.update(linked_checksums)
+            checksum_cache.put_many(
+                host,
+                [
+                    (path, *file_stats[path], checksum)
+                    for path, checksum in linked_checksums.items()
+                ],
+            )
+
+    hashed_paths = [path for paths in linked_paths.values() for path in paths]
+    failed = [path for path in hashed_paths if path not in checksums]
+
+    return checksums, len(hashed_paths) - len(failed), pending, failed
+
+
+def server_app_integrity_check(
+    fs,
+    host,
+    checksum_cache,
+    budget,
+    full_backup_locations,
+    server,
+    app,
+    server_backup_folders,
+    options,
+) -> bool:
+    """
+    Verifies the checksums of the files of each backup folder of an app, across the
+    given (latest first) snapshot folders, and reports files that kept the same size
+    but changed content since the previous snapshot (e.g., a truncated or corrupted
+    dump).
+    """
+    print("\n#")
+    print(
+        f"# Verifying backup checksums for {colored(app, "cyan")} on {colored(server, "magenta")}"
+    )
+    print("#\n")
+
+    app_backup_locations = full_backup_locations[server][app]["backup-folders"]
+
+    # Only the files are listed, on the server, with a single `find` per app
+    file_stats = get_remote_file_stats(
+        fs,
+        [
+            f"{folder_name}/data/{app}/{backup_folder}"
+            for backup_folder in app_backup_locations
+            for folder_name, _ in server_backup_folders
+        ],
+    )
+
+    checksums, hashed, pending, failed = verify_checksums(
+        fs, host, checksum_cache, file_stats, budget, options
+    )
+
+    print(
+        f"* {len(file_stats)} file(s) ({get_humanized_size(sum(size for size, _, _ in file_stats.values()))[1]}): {hashed} hashed, {len(file_stats) - hashed - len(pending) - len(failed)} unchanged since they were last hashed."
+    )
+    if pending:
+        print(
+            f"* {colored(f"{len(pending)} file(s) left for a later run", "yellow")} (byte budget reached)."
+        )
+    for path in failed:
+        print(f"{colored("* Could not hash", "red")} {path}")
+
+    check_passed = not failed
+
+    for backup_folder in app_backup_locations:
+        latest_folder, previous_folder = [
+            f"{folder_name}/data/{app}/{backup_folder}/"
+            for folder_name, _ in server_backup_folders[:2]
+        ]
+
+        # Same relative path and size as in the previous snapshot, different content
+        suspicious_files = []
+        for path, (size, _, _) in file_stats.items():
+            if not path.startswith(latest_folder):
+                continue
+
+            previous_path = previous_folder + path[len(latest_folder) :]
+            if (
+                previous_path in file_stats
+                and file_stats[previous_path][0] == size
+                and path in checksums
+                and previous_path in checksums
+                and checksums[path] != checksums[previous_path]
+            ):
+                suspicious_files.append(path[len(latest_folder) :])
+
+        if suspicious_files:
+            check_passed = False
+            print(
+                f"* {colored(backup_folder, "cyan")}: {colored(f"{len(suspicious_files)} file(s) kept their size but changed content", "red")} since {colored(server_backup_folders[1][1], "magenta")}:"
+            )
+            for name in suspicious_files[:SUSPICIOUS_FILES_PRINT_LIMIT]:
+                print(f"  {name}")
+            if len(suspicious_files) > SUSPICIOUS_FILES_PRINT_LIMIT:
+                print(
+                    f"  ... and {len(suspicious_files) - SUSPICIOUS_FILES_PRINT_LIMIT} more"
+                )
+        else:
+            print(
+                f"* {colored(backup_folder, "cyan")}: no same-size file with changed content. ✅"
+            )
+
+    return check_passed
+
+
+def backup_integrity_check(options) -> bool:
+    connection = run_host_check(None, "Backup server", backup_server_filesystem)
+    if connection is None:
+        return False
+
+    fs, address = connection
+
+    with open("file_structure/app_backups.json", "r") as file:
+        full_backup_locations = select_servers(json.load(file), options.servers)
+
+    checksum_cache = ChecksumCache(options.cache)
+    budget = ByteBudget(options.budget)
+
+    try:
+        for server in full_backup_locations:
+            report_section("integrity", server)
+
+            # Checks that fail because of the backup server (e.g., a timeout) are
+            # reported as "not checked" instead of stopping the run.
+            server_backup_folders = run_host_check(
+                address,
+                f"Backup folders of {server}",
+                get_server_backup_folders,
+                fs,
+                server,
+            )
+            if server_backup_folders is None:
+                continue
+
+            if len(server_backup_folders) < 2:
+                print(f"{server} has less than two backup folders to compare. ❌")
+                continue
+
+            for app in full_backup_locations[server]:
+                run_host_check(
+                    address,
+                    f"Backup checksums of {app} on {server}",
+                    server_app_integrity_check,
+                    fs,
+                    address,
+                    checksum_cache,
+                    budget,
+                    full_backup_locations,
+                    server,
+                    app,
+                    server_backup_folders,
+                    options,
+                )
+    finally:
+        checksum_cache.close()
+
+    return True
+
+
+def parse_options(argv=None):
+    parser = argparse.ArgumentParser(description="Backup checksum verification")
+    parser.add_argument(
+        "--budget",
+        type=parse_size,
+        default=None,
+        metavar="SIZE",
+        help="Maximum number of bytes hashed in this run (e.g., 500G); the rest is hashed in the next runs",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Number of files hashed by a single remote `sha256sum` call",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=DEFAULT_PARALLEL,
+        help="Number of `sha256sum` calls running at the same time on the server",
+    )
+    parser.add_argument(
+        "--cache",
+        default=DEFAULT_CHECKSUM_CACHE_PATH,
+        metavar="PATH",
+        help=f"Checksum cache file (default: {DEFAULT_CHECKSUM_CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--servers",
+        type=parse_server_list,
+        default=None,
+        metavar="SERVER,...",
+        help="Only check these servers (default: every configured server)",
+    )
+    options, _ = parser.parse_known_args(argv)
+
+    return options
+
+
+def main(argv=None):
+    backup_integrity_check(parse_options(argv))
+
+
+if __name__ == "__main__":
+    main()